@@ -0,0 +1,193 @@
+import os
+import re
+import sys
+import logging
+import argparse
+from datetime import datetime, date
+
+import requests
+
+from library_cache import CACHE_TTL_HOURS, load_section_items
+from playlist_buckets import (
+    by_added_month, by_decade, by_genre, by_year, existing_bucket_labels, fetch_unwatched_snapshot,
+    group_snapshot, is_decade_label, is_year_label
+)
+from playlist_sync import AdaptivePacer, sync_playlists
+from plex_client import METRICS, connect as connect_server
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+PLEX_URL = os.getenv("PLEX_URL", "http://localhost:32400")
+PLEX_TOKEN = os.getenv("PLEX_TOKEN", "")
+
+# Number of playlists reconciled concurrently
+try:
+    PLAYLIST_WORKERS = int(os.getenv("PLAYLIST_WORKERS", "4"))
+except ValueError:
+    PLAYLIST_WORKERS = 4
+
+# Playlist families: bucket function, playlist title suffix, and a check that recognises this
+# family's labels in existing playlist titles (so emptied buckets get their playlist deleted)
+PLAYLIST_FAMILIES = {
+    "year": (by_year, " Unwatched Combined", is_year_label),
+    "decade": (by_decade, " Unwatched Combined", is_decade_label),
+    "genre": (by_genre, " Unwatched Genre Mix", lambda label: bool(label)),
+    "added_month": (by_added_month, " Unwatched Added", lambda label: bool(re.fullmatch(r"\d{4}-\d{2}", label))),
+}
+DEFAULT_FAMILIES = os.getenv("PLAYLIST_FAMILIES", "year,decade").split(",")
+
+def setup_logging(name):
+    # Set up logging to a file in the same directory as the script
+    logging.basicConfig(
+        filename=os.path.join(script_dir, f"{name}.log"),
+        filemode='w',
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+
+    # Also output to console
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    logging.getLogger().addHandler(console_handler)
+
+def get_rebuild_hour():
+    # Get rebuild hour from env variable (default to 3 AM)
+    try:
+        return int(os.getenv("REBUILD_HOUR", "3"))
+    except ValueError:
+        logging.warning("Invalid REBUILD_HOUR value; falling back to 3")
+        return 3
+
+def should_do_rebuild(tracker_path, rebuild_hour):
+    now = datetime.now()
+
+    if now.hour < rebuild_hour:
+        return False
+
+    if not os.path.exists(tracker_path):
+        return True
+
+    with open(tracker_path, "r") as f:
+        last_rebuild_date = f.read().strip()
+
+    return last_rebuild_date != str(date.today())
+
+def mark_rebuild_done(tracker_path):
+    with open(tracker_path, "w") as f:
+        f.write(str(date.today()))
+
+# Timeouts and connection errors are retried with backoff by the client session
+def safe_get_section(plex_server, section_name):
+    from plexapi.exceptions import NotFound
+
+    try:
+        return plex_server.library.section(section_name)
+    except NotFound:
+        logging.warning(f"Library section '{section_name}' not found.")
+        raise RuntimeError(f"Library section '{section_name}' not found")
+    except requests.exceptions.RequestException as error:
+        raise RuntimeError(f"Failed to get section '{section_name}': {error}")
+
+# One pooled keep-alive session shared by all playlist workers
+def connect(product, pool_size=PLAYLIST_WORKERS):
+    return connect_server(PLEX_URL, PLEX_TOKEN, product, "combine-playlists-script", pool_size)
+
+def get_sections(plex):
+    # Safely fetch sections; returns (movies, tv shows, youtube or None)
+    movies_section = safe_get_section(plex, 'My Movies')
+    tv_shows_section = safe_get_section(plex, 'My TV Shows')
+    try:
+        youtube_section = safe_get_section(plex, 'YouTube')
+    except RuntimeError:
+        youtube_section = None
+        logging.warning("YouTube library section not found or unavailable. Skipping...")
+    return movies_section, tv_shows_section, youtube_section
+
+def load_snapshot(plex, sections):
+    # Unwatched items from the on-disk library cache (only changed items are fetched), or live when disabled
+    sections = [section for section in sections if section is not None]
+    if CACHE_TTL_HOURS > 0:
+        try:
+            return load_section_items(plex, sections, unwatched=True)
+        except Exception as e:
+            logging.warning(f"Library cache unavailable, fetching live: {e}")
+    return fetch_unwatched_snapshot(*sections)
+
+def owned_playlist_titles(families, existing_playlists):
+    # Existing playlists that belong to one of these families, so emptied buckets get deleted
+    titles = set()
+    for family in families:
+        _, suffix, is_label = PLAYLIST_FAMILIES[family]
+        titles |= {f"{label}{suffix}" for label in existing_bucket_labels(existing_playlists, suffix, is_label)}
+    return titles
+
+def desired_playlists_for(families, grouped, existing_playlists):
+    # {playlist title: items} for every bucket with content, plus owned playlists whose bucket emptied
+    desired = {}
+    for family in families:
+        _, suffix, _ = PLAYLIST_FAMILIES[family]
+        for label, items in grouped[family].items():
+            desired[f"{label}{suffix}"] = items
+    for title in owned_playlist_titles(families, existing_playlists):
+        desired.setdefault(title, [])
+    return dict(sorted(desired.items()))
+
+def combine_playlists(plex, families, pacer=None):
+    # One unwatched snapshot per section feeds every playlist family in this run
+    unwatched_items = load_snapshot(plex, get_sections(plex))
+    logging.info(f"Loaded {len(unwatched_items)} unwatched items in a single pass")
+    grouped = group_snapshot(unwatched_items, {family: PLAYLIST_FAMILIES[family][0] for family in families})
+
+    existing_playlists = plex.playlists()
+    desired_playlists = desired_playlists_for(families, grouped, existing_playlists)
+    if not desired_playlists:
+        logging.info("No valid content years found.")
+        return []
+
+    # Playlist writes are paced by measured server latency and run on a bounded worker pool
+    failed_playlists = sync_playlists(
+        plex, desired_playlists, pacer or AdaptivePacer(), max_workers=PLAYLIST_WORKERS,
+        existing_playlists=existing_playlists
+    )
+    if failed_playlists:
+        logging.error(f"{len(failed_playlists)} playlists failed: {', '.join(sorted(failed_playlists))}")
+    return failed_playlists
+
+def run(families, name="combine_playlists", product="CombinePlaylists"):
+    setup_logging(name)
+    logging.info("Script started")
+
+    unknown = [family for family in families if family not in PLAYLIST_FAMILIES]
+    if unknown:
+        raise ValueError(f"Unknown playlist families: {', '.join(unknown)}")
+
+    tracker_path = os.path.join(script_dir, f"last_rebuild_{name.replace('combine_playlists_', '')}.txt")
+    rebuild_hour = get_rebuild_hour()
+
+    # Determine whether this run is a rebuild or an incremental update
+    full_rebuild = should_do_rebuild(tracker_path, rebuild_hour)
+    if full_rebuild:
+        logging.info(f"Performing full rebuild (after {rebuild_hour}:00).")
+    else:
+        logging.info("Performing incremental update (playlist append/remove only).")
+
+    plex = connect(product)
+    combine_playlists(plex, families)
+
+    if full_rebuild:
+        mark_rebuild_done(tracker_path)
+        logging.info("Rebuild completed and marked as done for today.")
+    METRICS.log_summary()
+
+def main(argv=None, default_families=DEFAULT_FAMILIES, name="combine_playlists", product="CombinePlaylists"):
+    parser = argparse.ArgumentParser(description="Build the combined unwatched playlists.")
+    parser.add_argument("--families", default=",".join(default_families),
+                        help=f"Comma-separated playlist families ({', '.join(PLAYLIST_FAMILIES)})")
+    args = parser.parse_args(argv)
+
+    run([family.strip() for family in args.families.split(",") if family.strip()], name=name, product=product)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
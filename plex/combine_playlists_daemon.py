@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+
+from combine_playlists import (
+    DEFAULT_FAMILIES, PLAYLIST_FAMILIES, PLAYLIST_WORKERS, connect, get_sections, load_snapshot,
+    owned_playlist_titles, setup_logging
+)
+from playlist_sync import AdaptivePacer, playlist_sort_key, sync_playlists
+from plex_client import METRICS
+from watch_state import LIBRARY_IDENTIFIER
+
+# Seconds to collect events before touching the affected playlists
+FLUSH_SECONDS = float(os.getenv("DAEMON_FLUSH_SECONDS", "5"))
+
+# Times a change that failed to apply is retried before it is dropped
+CHANGE_RETRIES = 3
+
+# Timeline entry fields from the Plex notification websocket
+TIMELINE_TYPES = {1, 4}  # movie, episode
+TIMELINE_STATE_PROCESSED = 5
+TIMELINE_STATE_DELETED = 9
+
+def parse_notification(message):
+    # Reduce a NotificationContainer to [(rating_key, deleted)] for items whose
+    # watched or library state may have changed; keys are ints, like item.ratingKey
+    # that the cache is keyed by
+    changes = []
+
+    if message.get("type") == "timeline":
+        for entry in message.get("TimelineEntry", []):
+            if entry.get("identifier", LIBRARY_IDENTIFIER) != LIBRARY_IDENTIFIER:
+                continue
+            if int(entry.get("type", 0)) not in TIMELINE_TYPES:
+                continue
+            state = int(entry.get("state", -1))
+            if state == TIMELINE_STATE_DELETED:
+                changes.append((int(entry["itemID"]), True))
+            elif state == TIMELINE_STATE_PROCESSED:
+                changes.append((int(entry["itemID"]), False))
+
+    elif message.get("type") == "playing":
+        # A stopped session is when the server decides whether the item now counts as watched
+        for notification in message.get("PlaySessionStateNotification", []):
+            if notification.get("state") == "stopped":
+                changes.append((int(notification["ratingKey"]), False))
+
+    return changes
+
+class FakeNotificationSource(threading.Thread):
+    # Offline stand-in for plexapi's AlertListener: feeds NotificationContainer dicts to the callback
+    def __init__(self, callback, messages=(), interval=0.0):
+        super().__init__(daemon=True)
+        self.callback = callback
+        self.messages = list(messages)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        for message in self.messages:
+            if self.stopped.is_set():
+                break
+            self.send(message)
+            time.sleep(self.interval)
+
+    def send(self, message):
+        self.callback(message)
+
+    def stop(self):
+        self.stopped.set()
+
+def load_notifications(path):
+    # One NotificationContainer JSON object per line, as delivered by the websocket
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class PlaylistStateCache:
+    # Unwatched items of the tracked sections and the playlists each one belongs to
+    def __init__(self, families):
+        self.families = families
+        self.items = {}
+        self.memberships = {}
+        self.playlists = {}
+
+    def playlist_names(self, item):
+        names = set()
+        for family in self.families:
+            bucket_func, suffix, _ = PLAYLIST_FAMILIES[family]
+            names |= {f"{label}{suffix}" for label in bucket_func(item)}
+        return names
+
+    def upsert(self, item):
+        # Returns the playlists that need reconciling
+        previous = self.items.get(item.ratingKey)
+        old_names = self.memberships.get(item.ratingKey, set())
+        new_names = self.playlist_names(item)
+        if previous is not None and old_names == new_names and playlist_sort_key(previous) == playlist_sort_key(item):
+            self.items[item.ratingKey] = item
+            return set()
+
+        self.remove(item.ratingKey)
+        self.items[item.ratingKey] = item
+        self.memberships[item.ratingKey] = new_names
+        for name in new_names:
+            self.playlists.setdefault(name, {})[item.ratingKey] = item
+        return old_names | new_names
+
+    def remove(self, rating_key):
+        self.items.pop(rating_key, None)
+        old_names = self.memberships.pop(rating_key, set())
+        for name in old_names:
+            self.playlists.get(name, {}).pop(rating_key, None)
+        return old_names
+
+    def playlist_items(self, name):
+        return list(self.playlists.get(name, {}).values())
+
+def apply_change(plex, cache, section_ids, rating_key, deleted):
+    from plexapi.exceptions import NotFound
+
+    if deleted:
+        return cache.remove(rating_key)
+
+    try:
+        item = plex.fetchItem(rating_key)
+    except NotFound:
+        return cache.remove(rating_key)
+
+    if item.type not in ("movie", "episode") or item.librarySectionID not in section_ids:
+        return set()
+    if item.isWatched:
+        return cache.remove(item.ratingKey)
+    return cache.upsert(item)
+
+def run_daemon(plex, notification_source_factory, families, flush_seconds=FLUSH_SECONDS):
+    sections = [section for section in get_sections(plex) if section is not None]
+    section_ids = {section.key for section in sections}
+    pacer = AdaptivePacer()
+
+    # Seed the cache from one snapshot and reconcile everything once; after this only events drive updates
+    cache = PlaylistStateCache(families)
+    for item in load_snapshot(plex, sections):
+        cache.upsert(item)
+    logging.info(f"Cached {len(cache.items)} unwatched items across {len(cache.playlists)} playlists")
+
+    dirty = set(cache.playlists) | owned_playlist_titles(families, plex.playlists())
+
+    events = queue.Queue()
+
+    def on_notification(message):
+        for change in parse_notification(message):
+            events.put(change)
+
+    def on_error(error):
+        logging.error(f"Notification listener error: {error}")
+
+    listener = notification_source_factory(on_notification, on_error)
+    logging.info("Listening for Plex notifications")
+    last_flush = 0.0
+    # Changes that failed to apply (e.g. the server was briefly unreachable) are retried once per flush
+    retries = {}
+
+    try:
+        while True:
+            try:
+                rating_key, deleted = events.get(timeout=flush_seconds)
+                try:
+                    dirty |= apply_change(plex, cache, section_ids, rating_key, deleted)
+                    retries.pop((rating_key, deleted), None)
+                except Exception as e:
+                    attempts = retries.get((rating_key, deleted), 0) + 1
+                    if attempts > CHANGE_RETRIES:
+                        logging.error(f"Giving up on change for item {rating_key}: {e}")
+                        retries.pop((rating_key, deleted), None)
+                    else:
+                        logging.warning(f"Failed to apply change for item {rating_key} (attempt {attempts}): {e}")
+                        retries[(rating_key, deleted)] = attempts
+            except queue.Empty:
+                pass
+
+            # A replayed (or disconnected) source has nothing more to send: flush once more and stop
+            finished = not listener.is_alive() and events.empty() and not retries
+            if finished or time.monotonic() - last_flush >= flush_seconds:
+                if dirty:
+                    desired_playlists = {name: cache.playlist_items(name) for name in sorted(dirty)}
+                    logging.info(f"Reconciling {len(desired_playlists)} playlists")
+                    dirty = set(sync_playlists(plex, desired_playlists, pacer, max_workers=PLAYLIST_WORKERS))
+                last_flush = time.monotonic()
+                for change in retries:
+                    events.put(change)
+            if finished:
+                logging.info("Notification source finished")
+                break
+    except KeyboardInterrupt:
+        logging.info("Stopping daemon")
+    finally:
+        listener.stop()
+        METRICS.log_summary()
+
+def main(argv=None, plex=None):
+    parser = argparse.ArgumentParser(description="Keep the combined unwatched playlists current from Plex notifications.")
+    parser.add_argument("--families", default=",".join(DEFAULT_FAMILIES),
+                        help=f"Comma-separated playlist families ({', '.join(PLAYLIST_FAMILIES)})")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="Replay NotificationContainer JSON lines instead of listening to the server "
+                             "(sections, the snapshot and changed items are still read from the server)")
+    parser.add_argument("--interval", type=float, default=0.0, help="Seconds between replayed notifications")
+    args = parser.parse_args(argv)
+
+    families = [family.strip() for family in args.families.split(",") if family.strip()]
+    unknown = [family for family in families if family not in PLAYLIST_FAMILIES]
+    if unknown:
+        raise ValueError(f"Unknown playlist families: {', '.join(unknown)}")
+
+    setup_logging("combine_playlists_daemon")
+    logging.info("Script started")
+    # A server object may be passed in, e.g. to replay notifications against a stand-in
+    plex = plex or connect("CombinePlaylistsDaemon")
+
+    if args.replay:
+        messages = load_notifications(args.replay)
+
+        def source_factory(callback, _error_callback):
+            source = FakeNotificationSource(callback, messages, args.interval)
+            source.start()
+            return source
+    else:
+        def source_factory(callback, error_callback):
+            return plex.startAlertListener(callback=callback, callbackError=error_callback)
+
+    run_daemon(plex, source_factory, families)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
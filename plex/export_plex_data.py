@@ -1,100 +1,42 @@
-import os
-import requests
+import sys
+import time
 import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import repeat
 from xml.etree import ElementTree
-from tqdm import tqdm
 
-def get_available_servers():
-    return [
-        server_key[len("PLEX_TOKEN_"):]
-        for server_key in os.environ
-        if server_key.startswith("PLEX_TOKEN_")
-    ]
-
-available_servers = get_available_servers()
-
-if not available_servers:
-    raise EnvironmentError("No Plex server environment variables found. Please run setup_plex_env.py first.")
-
-print("Available Plex servers:")
-for idx, name in enumerate(available_servers, 1):
-    print(f"  {idx}. {name}")
-
-try:
-    choice = int(input("Enter the number of the server to use: ").strip())
-    selected = available_servers[choice - 1]
-except (ValueError, IndexError):
-    raise ValueError("Invalid selection. Please enter a valid number from the list.")
-
-PLEX_TOKEN = os.getenv(f"PLEX_TOKEN_{selected}")
-PLEX_BASE_URL = os.getenv(f"PLEX_BASE_URL_{selected}")
-
-if not PLEX_TOKEN or not PLEX_BASE_URL:
-    raise EnvironmentError(f"Missing env variables for {selected}: PLEX_TOKEN_{selected} and/or PLEX_BASE_URL_{selected}")
-
-HEADERS = {'X-Plex-Token': PLEX_TOKEN}
-DB_FILE = f"plex_export_{selected}.db"
-
-# Setup SQLite
-conn = sqlite3.connect(DB_FILE)
-cur = conn.cursor()
-cur.execute('''
-CREATE TABLE IF NOT EXISTS media (
-    rating_key TEXT PRIMARY KEY,
-    title TEXT,
-    library_section TEXT,
-    guid TEXT,
-    file_path TEXT,
-    duration INTEGER,
-    view_count INTEGER,
-    last_viewed_at INTEGER,
-    view_offset INTEGER,
-    user_rating REAL
-)
-''')
-conn.commit()
-
-def get_libraries():
-    url = f'{PLEX_BASE_URL}/library/sections'
-    res = requests.get(url, headers=HEADERS)
-    res.raise_for_status()
-    xml = ElementTree.fromstring(res.content)
-    return [(el.attrib['key'], el.attrib['title']) for el in xml.findall('.//Directory')]
-
-def get_episodes(show_rating_key):
-    url = f"{PLEX_BASE_URL}/library/metadata/{show_rating_key}/allLeaves"
-    res = requests.get(url, headers=HEADERS)
-    res.raise_for_status()
-    return ElementTree.fromstring(res.content)
-
-def get_items(library_key):
-    all_items = []
-    start = 0
-    batch_size = 1000
-
-    while True:
-        url = (
-            f'{PLEX_BASE_URL}/library/sections/{library_key}/all'
-            f'?X-Plex-Container-Start={start}&X-Plex-Container-Size={batch_size}'
-        )
-        res = requests.get(url, headers=HEADERS)
-        res.raise_for_status()
-        xml = ElementTree.fromstring(res.content)
-
-        library_items = xml.findall('.//Video') + xml.findall('.//Directory')
-        if not library_items:
-            break  # No more to fetch
-
-        all_items.extend(library_items)
-        start += batch_size
-
-    return all_items
-
-def get_metadata(rating_key):
-    url = f'{PLEX_BASE_URL}/library/metadata/{rating_key}'
-    res = requests.get(url, headers=HEADERS)
-    res.raise_for_status()
-    return ElementTree.fromstring(res.content)
+from export_schema import migrate, to_float, to_int
+from parquet_export import export_parquet, require_pyarrow
+from plex_client import METRICS, get_available_servers, get_server_config, make_session
+
+# Library paging: page size adapts to server latency, remaining pages are prefetched concurrently
+INITIAL_BATCH_SIZE = 1000
+MIN_BATCH_SIZE = 200
+MAX_BATCH_SIZE = 5000
+TARGET_PAGE_SECONDS = 2.0
+PREFETCH_WORKERS = 4
+
+def select_server(available_servers):
+    print("Available Plex servers:")
+    for idx, name in enumerate(available_servers, 1):
+        print(f"  {idx}. {name}")
+
+    try:
+        choice = int(input("Enter the number of the server to use: ").strip())
+        return available_servers[choice - 1]
+    except (ValueError, IndexError):
+        raise ValueError("Invalid selection. Please enter a valid number from the list.")
+
+def adapt_batch_size(batch_size, elapsed):
+    # Scale the page so a single request takes roughly TARGET_PAGE_SECONDS
+    if elapsed <= 0:
+        return MAX_BATCH_SIZE
+    scaled = int(batch_size * TARGET_PAGE_SECONDS / elapsed)
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, scaled))
+
+def page_items(xml):
+    return xml.findall('.//Video') + xml.findall('.//Directory')
 
 def extract_file_path(metadata_xml):
     media = metadata_xml.find('.//Media')
@@ -104,168 +46,276 @@ def extract_file_path(metadata_xml):
             return part.attrib.get('file')
     return None
 
-def export_plex_library():
-    print("📡 Connecting to Plex...")
-    libraries = get_libraries()
+class PlexExporter:
+    # Exports one server into plex_export_<name>.db; several exporters can run side by side
+    def __init__(self, name, base_url, token, position=0, prefix_output=False, parquet_dir=None):
+        self.name = name
+        self.base_url = base_url
+        self.db_file = f"plex_export_{name}.db"
+        self.parquet_dir = parquet_dir
+        self.position = position
+        self.prefix = f"[{name}] " if prefix_output else ""
+        # One keep-alive session for every request, pooled for the prefetch workers
+        self.session = make_session({'X-Plex-Token': token}, PREFETCH_WORKERS)
+        self.conn = None
+        self.cur = None
+
+    def log(self, message):
+        # tqdm.write keeps messages from clobbering the progress bars of concurrent exports
+        from tqdm import tqdm
+        text = message.lstrip("\n")
+        tqdm.write(f"{message[:len(message) - len(text)]}{self.prefix}{text}")
+
+    def progress(self, iterable, desc):
+        from tqdm import tqdm
+        return tqdm(iterable, desc=f"{self.prefix}{desc}", position=self.position, leave=not self.prefix)
+
+    def open_db(self):
+        # Opened in the exporting thread; sqlite connections can't be shared across threads
+        self.conn = sqlite3.connect(self.db_file)
+        self.cur = self.conn.cursor()
+        migrate(self.conn)
+
+    def get_xml(self, path):
+        res = self.session.get(f'{self.base_url}{path}')
+        res.raise_for_status()
+        return ElementTree.fromstring(res.content)
 
-    for key, title in libraries:
-        print(f"\n📁 Scanning library: {title}")
-        items = get_items(key)
+    def get_libraries(self):
+        xml = self.get_xml('/library/sections')
+        return [(el.attrib['key'], el.attrib['title']) for el in xml.findall('.//Directory')]
 
-        for export_item in tqdm(items, desc=f"Exporting {title}"):
-            try:
-                item_type = export_item.attrib.get("type")
+    def get_episodes(self, show_rating_key):
+        return self.get_xml(f"/library/metadata/{show_rating_key}/allLeaves")
 
-                if item_type == "show":
-                    episode_xml = get_episodes(export_item.attrib["ratingKey"])
-                    for episode in episode_xml.findall(".//Video"):
-                        process_item(episode, title)
-                else:
-                    process_item(export_item, title)
+    def get_metadata(self, rating_key):
+        return self.get_xml(f'/library/metadata/{rating_key}')
 
-            except Exception as e:
-                print(
-                    f"⚠️ Error processing item {export_item.attrib.get('title', 'Unknown')} (type: {export_item.attrib.get('type')}): {e}"
-                )
-
-    export_playlists()
-
-    print("\n✅ Export complete. Data saved to", DB_FILE)
-    conn.close()
-
-def export_playlists():
-    print("\n🎶 Exporting playlists...")
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS playlists (
-        rating_key TEXT PRIMARY KEY,
-        title TEXT,
-        playlist_type TEXT,
-        leaf_count INTEGER,
-        smart INTEGER,
-        duration INTEGER,
-        added_at INTEGER,
-        updated_at INTEGER,
-        summary TEXT
-    )
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS playlist_items (
-        playlist_rating_key TEXT,
-        item_rating_key TEXT,
-        item_guid TEXT,
-        item_title TEXT,
-        item_type TEXT,
-        file_path TEXT,
-        view_count INTEGER,
-        last_viewed_at INTEGER,
-        view_offset INTEGER,
-        user_rating REAL,
-        added_at INTEGER,
-        originally_available_at INTEGER,
-        PRIMARY KEY (playlist_rating_key, item_rating_key)
-    )
-    ''')
-    conn.commit()
-
-    url = f"{PLEX_BASE_URL}/playlists"
-    res = requests.get(url, headers=HEADERS)
-    res.raise_for_status()
-    xml = ElementTree.fromstring(res.content)
-    playlists = xml.findall(".//Playlist")
-
-    print(f"📋 Found {len(playlists)} playlists to export.")
-
-    for pl in tqdm(playlists, desc="Playlists"):
-        pl_data = {
-            'rating_key': pl.attrib.get('ratingKey'),
-            'title': pl.attrib.get('title'),
-            'playlist_type': pl.attrib.get('playlistType'),
-            'leaf_count': int(pl.attrib.get('leafCount', 0)),
-            'smart': int(pl.attrib.get('smart', '0')),
-            'duration': int(pl.attrib.get('duration', 0)),
-            'added_at': int(pl.attrib.get('addedAt', 0)),
-            'updated_at': int(pl.attrib.get('updatedAt', 0)),
-            'summary': pl.attrib.get('summary', '')
+    def fetch_items_page(self, library_key, start, batch_size):
+        started = time.monotonic()
+        xml = self.get_xml(
+            f'/library/sections/{library_key}/all'
+            f'?X-Plex-Container-Start={start}&X-Plex-Container-Size={batch_size}'
+        )
+        return xml, time.monotonic() - started
+
+    def get_items(self, library_key):
+        batch_size = INITIAL_BATCH_SIZE
+        xml, elapsed = self.fetch_items_page(library_key, 0, batch_size)
+        all_items = page_items(xml)
+        total_size = xml.attrib.get('totalSize')
+
+        if total_size is None:
+            # Server didn't report totalSize; page serially until a short page comes back
+            start = batch_size
+            while len(page_items(xml)) >= batch_size:
+                xml, elapsed = self.fetch_items_page(library_key, start, batch_size)
+                all_items.extend(page_items(xml))
+                start += batch_size
+            return all_items
+
+        total_size = int(total_size)
+        start = batch_size
+
+        # Prefetch the remaining pages in concurrent waves, resizing pages between waves
+        with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+            while start < total_size:
+                batch_size = adapt_batch_size(batch_size, elapsed)
+                starts = list(range(start, min(total_size, start + batch_size * PREFETCH_WORKERS), batch_size))
+                pages = list(executor.map(self.fetch_items_page, repeat(library_key), starts, repeat(batch_size)))
+
+                for page_xml, _ in pages:
+                    all_items.extend(page_items(page_xml))
+
+                elapsed = max(page_elapsed for _, page_elapsed in pages)
+                start = starts[-1] + batch_size
+
+        return all_items
+
+    def export(self):
+        self.log("📡 Connecting to Plex...")
+        self.open_db()
+        libraries = self.get_libraries()
+
+        for key, title in libraries:
+            self.log(f"\n📁 Scanning library: {title}")
+            items = self.get_items(key)
+
+            for export_item in self.progress(items, f"Exporting {title}"):
+                try:
+                    item_type = export_item.attrib.get("type")
+
+                    if item_type == "show":
+                        episode_xml = self.get_episodes(export_item.attrib["ratingKey"])
+                        for episode in episode_xml.findall(".//Video"):
+                            self.process_item(episode, title)
+                    else:
+                        self.process_item(export_item, title)
+
+                except Exception as e:
+                    self.log(
+                        f"⚠️ Error processing item {export_item.attrib.get('title', 'Unknown')} (type: {export_item.attrib.get('type')}): {e}"
+                    )
+
+        self.export_playlists()
+
+        self.log(f"\n✅ Export complete. Data saved to {self.db_file}")
+        self.conn.close()
+        self.session.close()
+
+        if self.parquet_dir:
+            for path in export_parquet(self.db_file, self.parquet_dir, self.name):
+                self.log(f"📦 Wrote {path}")
+
+    def export_playlists(self):
+        self.log("\n🎶 Exporting playlists...")
+
+        xml = self.get_xml("/playlists")
+        playlists = xml.findall(".//Playlist")
+
+        self.log(f"📋 Found {len(playlists)} playlists to export.")
+
+        for pl in self.progress(playlists, "Playlists"):
+            pl_data = {
+                'rating_key': pl.attrib.get('ratingKey'),
+                'title': pl.attrib.get('title'),
+                'playlist_type': pl.attrib.get('playlistType'),
+                'leaf_count': int(pl.attrib.get('leafCount', 0)),
+                'smart': int(pl.attrib.get('smart', '0')),
+                'duration': int(pl.attrib.get('duration', 0)),
+                'added_at': int(pl.attrib.get('addedAt', 0)),
+                'updated_at': int(pl.attrib.get('updatedAt', 0)),
+                'summary': pl.attrib.get('summary', '')
+            }
+
+            self.cur.execute('''
+            INSERT OR REPLACE INTO playlists
+            (rating_key, title, playlist_type, leaf_count, smart, duration, added_at, updated_at, summary)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                pl_data['rating_key'], pl_data['title'], pl_data['playlist_type'],
+                pl_data['leaf_count'], pl_data['smart'], pl_data['duration'],
+                pl_data['added_at'], pl_data['updated_at'], pl_data['summary']
+            ))
+            self.conn.commit()
+
+            # Get playlist items
+            pl_xml = self.get_xml(f"/playlists/{pl_data['rating_key']}/items")
+            pl_media_items = pl_xml.findall('.//Video') + pl_xml.findall('.//Track')
+
+            if not pl_media_items:
+                self.log(f"⚠️ Playlist '{pl_data['title']}' is empty.")
+            else:
+                self.log(f"✅ Saved playlist: '{pl_data['title']}' with {len(pl_media_items)} items:")
+                for item in pl_media_items:
+                    self.log(f"   - {item.attrib.get('title') or item.attrib.get('grandparentTitle')}")
+
+            for item in pl_media_items:
+                rating_key = item.attrib.get('ratingKey')
+                meta_xml = self.get_metadata(rating_key)
+                file_path = extract_file_path(meta_xml)
+                self.cur.execute('''
+                INSERT OR REPLACE INTO playlist_items (
+                    playlist_rating_key, item_rating_key, item_guid, item_title, item_type,
+                    file_path, view_count, last_viewed_at, view_offset, user_rating,
+                    added_at, originally_available_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    pl_data['rating_key'],
+                    rating_key,
+                    item.attrib.get('guid'),
+                    item.attrib.get('title') or item.attrib.get('grandparentTitle'),
+                    item.attrib.get('type'),
+                    file_path,
+                    to_int(item.attrib.get('viewCount')),
+                    to_int(item.attrib.get('lastViewedAt')),
+                    to_int(item.attrib.get('viewOffset')),
+                    to_float(item.attrib.get('userRating')),
+                    to_int(item.attrib.get('addedAt')),
+                    item.attrib.get('originallyAvailableAt')
+                ))
+            self.conn.commit()
+
+    def process_item(self, item, section_title):
+        data = {
+            'rating_key': item.attrib.get('ratingKey'),
+            'title': item.attrib.get('title') or item.attrib.get('grandparentTitle'),
+            'library_section': section_title,
+            'guid': item.attrib.get('guid'),
+            'duration': to_int(item.attrib.get('duration')),
+            'view_count': to_int(item.attrib.get('viewCount')),
+            'last_viewed_at': to_int(item.attrib.get('lastViewedAt')),
+            'view_offset': to_int(item.attrib.get('viewOffset')),
+            'user_rating': to_float(item.attrib.get('userRating')),
+            'year': to_int(item.attrib.get('year')),
+            'file_path': None
         }
 
-        cur.execute('''
-        INSERT OR REPLACE INTO playlists
-        (rating_key, title, playlist_type, leaf_count, smart, duration, added_at, updated_at, summary)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        meta = self.get_metadata(data['rating_key'])
+        data['file_path'] = extract_file_path(meta)
+
+        self.cur.execute('''
+            INSERT OR REPLACE INTO media
+            (rating_key, title, library_section, guid, file_path, duration, view_count, last_viewed_at, view_offset, user_rating,
+             year)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
-            pl_data['rating_key'], pl_data['title'], pl_data['playlist_type'],
-            pl_data['leaf_count'], pl_data['smart'], pl_data['duration'],
-            pl_data['added_at'], pl_data['updated_at'], pl_data['summary']
+            data['rating_key'], data['title'], data['library_section'], data['guid'], data['file_path'],
+            data['duration'], data['view_count'], data['last_viewed_at'], data['view_offset'], data['user_rating'],
+            data['year']
         ))
-        conn.commit()
-
-        # Get playlist items
-        pl_items_url = f"{PLEX_BASE_URL}/playlists/{pl_data['rating_key']}/items"
-        pl_items_res = requests.get(pl_items_url, headers=HEADERS)
-        pl_items_res.raise_for_status()
-        pl_xml = ElementTree.fromstring(pl_items_res.content)
-        pl_media_items = pl_xml.findall('.//Video') + pl_xml.findall('.//Track')
-
-        if not pl_media_items:
-            print(f"⚠️ Playlist '{pl_data['title']}' is empty.")
-        else:
-            print(f"✅ Saved playlist: '{pl_data['title']}' with {len(pl_media_items)} items:")
-            for item in pl_media_items:
-                print(f"   - {item.attrib.get('title') or item.attrib.get('grandparentTitle')}")
-
-        for item in pl_media_items:
-            rating_key = item.attrib.get('ratingKey')
-            meta_xml = get_metadata(rating_key)
-            file_path = extract_file_path(meta_xml)
-            cur.execute('''
-            INSERT OR REPLACE INTO playlist_items (
-                playlist_rating_key, item_rating_key, item_guid, item_title, item_type,
-                file_path, view_count, last_viewed_at, view_offset, user_rating,
-                added_at, originally_available_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                pl_data['rating_key'],
-                rating_key,
-                item.attrib.get('guid'),
-                item.attrib.get('title') or item.attrib.get('grandparentTitle'),
-                item.attrib.get('type'),
-                file_path,
-                item.attrib.get('viewCount'),
-                item.attrib.get('lastViewedAt'),
-                item.attrib.get('viewOffset'),
-                item.attrib.get('userRating'),
-                item.attrib.get('addedAt'),
-                item.attrib.get('originallyAvailableAt')
-            ))
-        conn.commit()
-
-def process_item(item, section_title):
-    data = {
-        'rating_key': item.attrib.get('ratingKey'),
-        'title': item.attrib.get('title') or item.attrib.get('grandparentTitle'),
-        'library_section': section_title,
-        'guid': item.attrib.get('guid'),
-        'duration': item.attrib.get('duration'),
-        'view_count': item.attrib.get('viewCount'),
-        'last_viewed_at': item.attrib.get('lastViewedAt'),
-        'view_offset': item.attrib.get('viewOffset'),
-        'user_rating': item.attrib.get('userRating'),
-        'file_path': None
-    }
-
-    meta = get_metadata(data['rating_key'])
-    data['file_path'] = extract_file_path(meta)
-
-    cur.execute('''
-        INSERT OR REPLACE INTO media 
-        (rating_key, title, library_section, guid, file_path, duration, view_count, last_viewed_at, view_offset, user_rating)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        data['rating_key'], data['title'], data['library_section'], data['guid'], data['file_path'],
-        data['duration'], data['view_count'], data['last_viewed_at'], data['view_offset'], data['user_rating']
-    ))
-    conn.commit()
+        self.conn.commit()
+
+def export_all_servers(servers, parquet_dir=None):
+    from tqdm import tqdm
+    # Every server exports concurrently into its own DB; total time is that of the slowest server
+    exporters = [
+        PlexExporter(name, *get_server_config(name), position=position, prefix_output=True, parquet_dir=parquet_dir)
+        for position, name in enumerate(servers)
+    ]
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(exporters)) as executor:
+        futures = {executor.submit(exporter.export): exporter for exporter in exporters}
+        for future in as_completed(futures):
+            exporter = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                tqdm.write(f"❌ Export of '{exporter.name}' failed: {e}")
+                failed.append(exporter.name)
+
+    print(f"\n✅ Exported {len(exporters) - len(failed)} of {len(exporters)} servers")
+    for name in failed:
+        print(f" - failed: {name}")
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export Plex watch state and playlists to SQLite.")
+    servers = parser.add_mutually_exclusive_group()
+    servers.add_argument("--all", action="store_true",
+                         help="Export every PLEX_TOKEN_<name> server concurrently, without prompting")
+    servers.add_argument("--server", help="Export only this server (the <name> of PLEX_TOKEN_<name>), without prompting")
+    parser.add_argument("--parquet", metavar="DIR",
+                        help="Also write typed Parquet copies of the export tables to DIR (needs pyarrow)")
+    args = parser.parse_args(argv)
+
+    if args.parquet:
+        # Fail before a long export rather than after it
+        require_pyarrow()
+
+    available_servers = get_available_servers()
+    if not available_servers:
+        raise EnvironmentError("No Plex server environment variables found. Please run setup_plex_env.py first.")
+
+    if args.all:
+        failed = export_all_servers(available_servers, args.parquet)
+    else:
+        selected = args.server or select_server(available_servers)
+        failed = []
+        PlexExporter(selected, *get_server_config(selected), parquet_dir=args.parquet).export()
+
+    METRICS.log_summary(print)
+    return 1 if failed else 0
 
 if __name__ == '__main__':
-    export_plex_library()
+    sys.exit(main())
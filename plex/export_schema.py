@@ -0,0 +1,138 @@
+import sqlite3
+
+# Schema of plex_export_<name>.db, versioned with PRAGMA user_version. Each migration upgrades
+# the DB by one version; existing exports are upgraded when opened by the export or import.
+
+# Numeric columns that older exports may hold as text (raw XML attribute strings)
+INTEGER_COLUMNS = {
+    "media": ("duration", "view_count", "last_viewed_at", "view_offset"),
+    "playlist_items": ("view_count", "last_viewed_at", "view_offset", "added_at"),
+}
+REAL_COLUMNS = {
+    "media": ("user_rating",),
+    "playlist_items": ("user_rating",),
+}
+
+def to_int(value):
+    if value in (None, ""):
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def to_float(value):
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def create_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS media (
+        rating_key TEXT PRIMARY KEY,
+        title TEXT,
+        library_section TEXT,
+        guid TEXT,
+        file_path TEXT,
+        duration INTEGER,
+        view_count INTEGER,
+        last_viewed_at INTEGER,
+        view_offset INTEGER,
+        user_rating REAL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS playlists (
+        rating_key TEXT PRIMARY KEY,
+        title TEXT,
+        playlist_type TEXT,
+        leaf_count INTEGER,
+        smart INTEGER,
+        duration INTEGER,
+        added_at INTEGER,
+        updated_at INTEGER,
+        summary TEXT
+    )
+    ''')
+    create_playlist_items(conn)
+
+def create_playlist_items(conn, name="playlist_items"):
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {name} (
+        playlist_rating_key TEXT,
+        item_rating_key TEXT,
+        item_guid TEXT,
+        item_title TEXT,
+        item_type TEXT,
+        file_path TEXT,
+        view_count INTEGER,
+        last_viewed_at INTEGER,
+        view_offset INTEGER,
+        user_rating REAL,
+        added_at INTEGER,
+        originally_available_at TEXT,
+        PRIMARY KEY (playlist_rating_key, item_rating_key)
+    )
+    ''')
+
+def convert_numbers(conn):
+    # Empty strings become NULL and leftover text numbers become real numbers, so
+    # "IS NOT NULL" filters and comparisons behave the same for old and new exports
+    for columns, cast in ((INTEGER_COLUMNS, "INTEGER"), (REAL_COLUMNS, "REAL")):
+        for table, names in columns.items():
+            for column in names:
+                conn.execute(f"UPDATE {table} SET {column} = NULL WHERE {column} = ''")
+                conn.execute(f"UPDATE {table} SET {column} = CAST({column} AS {cast}) WHERE typeof({column}) = 'text'")
+
+def add_lookup_indexes(conn):
+    # Library filter of the import, and the guid/file path lookups used to match items across servers
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_library_section ON media (library_section)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_guid ON media (guid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_file_path ON media (file_path)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_playlist_items_guid ON playlist_items (item_guid)")
+
+def add_media_year(conn):
+    # Release year, so items without a guid or file path match on title and year, not title alone
+    if "year" not in {row[1] for row in conn.execute("PRAGMA table_info(media)")}:
+        conn.execute("ALTER TABLE media ADD COLUMN year INTEGER")
+
+def retype_release_dates(conn):
+    # playlist_items.originally_available_at holds YYYY-MM-DD text but was declared INTEGER; SQLite
+    # can't change a column type in place, so the table is rebuilt with the same rows
+    declared = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(playlist_items)")}
+    if declared.get("originally_available_at") == "TEXT":
+        return
+    columns = ", ".join(declared)
+    create_playlist_items(conn, "playlist_items_retyped")
+    conn.execute(f"INSERT INTO playlist_items_retyped ({columns}) SELECT {columns} FROM playlist_items ORDER BY rowid")
+    conn.execute("UPDATE playlist_items_retyped SET originally_available_at = NULL WHERE originally_available_at = ''")
+    conn.execute("DROP TABLE playlist_items")
+    conn.execute("ALTER TABLE playlist_items_retyped RENAME TO playlist_items")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_playlist_items_guid ON playlist_items (item_guid)")
+
+# Append only; a DB at version N has had MIGRATIONS[:N] applied
+MIGRATIONS = [
+    create_tables,
+    convert_numbers,
+    add_lookup_indexes,
+    add_media_year,
+    retype_release_dates,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn):
+    # Brings the DB up to SCHEMA_VERSION; returns the version it started at
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            f"Export DB schema version {version} is newer than this script supports ({SCHEMA_VERSION})"
+        )
+
+    for number in range(version, SCHEMA_VERSION):
+        with conn:
+            MIGRATIONS[number](conn)
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+    return version
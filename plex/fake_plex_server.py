@@ -0,0 +1,134 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.etree import ElementTree
+
+# Offline stand-in for the slice of the Plex HTTP API the sync scripts use: section listings
+# (with >>= timestamp and unwatched filters), item metadata and the scrobble/progress/rate endpoints.
+# Items are attribute dicts; "file" becomes a Media/Part child.
+LEAF_TYPE_NAMES = {"1": "movie", "4": "episode", "10": "track"}
+
+class FakePlexServer:
+    def __init__(self, sections, items, clock=time.time):
+        # sections: [(key, title, type)]; items: [attribute dict with ratingKey, librarySectionID, type, ...]
+        self.sections = sections
+        self.items = {str(item["ratingKey"]): dict(item) for item in items}
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.requests = []
+        self.httpd = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def do_PUT(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def watch(self, rating_key, view_offset=None):
+        # Simulate playback on this server: finished (no offset) or stopped at view_offset ms
+        with self.lock:
+            item = self.items[str(rating_key)]
+            if view_offset is None:
+                item["viewCount"] = int(item.get("viewCount") or 0) + 1
+                item.pop("viewOffset", None)
+            else:
+                item["viewOffset"] = int(view_offset)
+            item["lastViewedAt"] = int(self.clock())
+
+    def element(self, item):
+        attrib = {key: str(value) for key, value in item.items() if key != "file"}
+        element = ElementTree.Element("Track" if item.get("type") == "track" else "Video", attrib)
+        if item.get("file"):
+            media = ElementTree.SubElement(element, "Media")
+            ElementTree.SubElement(media, "Part", {"file": item["file"]})
+        return element
+
+    def container(self, children=(), **attrib):
+        root = ElementTree.Element("MediaContainer", {key: str(value) for key, value in attrib.items()})
+        root.extend(children)
+        return ElementTree.tostring(root)
+
+    def route(self, method, path, query):
+        if path == "/library/sections":
+            return 200, self.container([
+                ElementTree.Element("Directory", {"key": str(key), "title": title, "type": kind})
+                for key, title, kind in self.sections
+            ])
+
+        if path.startswith("/library/sections/") and path.endswith("/all"):
+            section_key = path.split("/")[3]
+            leaf_type = LEAF_TYPE_NAMES.get(query.get("type", ""))
+            # "field>>" filters keep items strictly after the timestamp, as Plex does; unwatched=1 keeps unplayed items
+            since = {key[:-2]: int(value) for key, value in query.items() if key.endswith(">>")}
+            unwatched = query.get("unwatched") == "1"
+            items = [
+                item for item in self.items.values()
+                if str(item.get("librarySectionID")) == section_key
+                and (leaf_type is None or item.get("type") == leaf_type)
+                and all(int(item.get(field) or 0) > value for field, value in since.items())
+                and not (unwatched and int(item.get("viewCount") or 0))
+            ]
+            if query.get("X-Plex-Container-Size") == "0":
+                return 200, self.container(totalSize=len(items), size=0)
+            return 200, self.container([self.element(item) for item in items], totalSize=len(items))
+
+        if path.startswith("/library/metadata/"):
+            # "/library/metadata/a,b,c" returns the items that exist, 404 if none does
+            items = [self.items[key] for key in path.split("/")[3].split(",") if key in self.items]
+            if not items:
+                return 404, b""
+            return 200, self.container([self.element(item) for item in items])
+
+        if path in ("/:/scrobble", "/:/progress", "/:/rate"):
+            # Like Plex, ratings are only accepted as PUT and play state only as GET
+            if method != ("PUT" if path == "/:/rate" else "GET"):
+                return 405, b""
+            item = self.items.get(query.get("key", ""))
+            if item is None:
+                return 404, b""
+            if path == "/:/scrobble":
+                self.watch(query["key"])
+            elif path == "/:/progress":
+                self.watch(query["key"], int(query["time"]))
+            else:
+                item["userRating"] = query["rating"]
+            return 200, b""
+
+        if path in ("/", "/identity"):
+            return 200, self.container(machineIdentifier="fake")
+
+        return 404, b""
+
+    def handle(self, request):
+        url = urlsplit(request.path)
+        # Plex filter operators split at their "=": "lastViewedAt>>=N" parses as {"lastViewedAt>>": "N"}
+        query = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        with self.lock:
+            self.requests.append((request.command, url.path))
+        status, body = self.route(request.command, url.path, query)
+        request.send_response(status)
+        request.send_header("Content-Type", "text/xml")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
@@ -1,135 +1,201 @@
 import os
-import sqlite3
-import requests
-from urllib.parse import quote
-from xml.etree import ElementTree
-
-def get_available_servers():
-    return [
-        var[len("PLEX_TOKEN_"):]
-        for var in os.environ
-        if var.startswith("PLEX_TOKEN_")
-    ]
-
-# === Select Plex Server ===
-servers = get_available_servers()
-if not servers:
-    raise RuntimeError("No PLEX_TOKEN_<server> env vars found.")
-
-print("Available Plex servers:")
-for i, name in enumerate(servers, 1):
-    print(f"  {i}. {name}")
-
-try:
-    selection = int(input("Select a Plex server by number: ").strip())
-    server = servers[selection - 1]
-except (ValueError, IndexError):
-    raise ValueError("Invalid server selection.")
-
-PLEX_TOKEN = os.getenv(f"PLEX_TOKEN_{server}")
-PLEX_BASE_URL = os.getenv(f"PLEX_BASE_URL_{server}")
-
-# === Let user choose DB file to import from ===
+import sys
 import glob
+import sqlite3
+import argparse
+
+from export_schema import migrate
+from media_index import build_section_index, get_sections
+from media_map import MediaMap
+from playlist_restore import restore_playlists
+from plex_client import METRICS, get_available_servers, get_server_config
+from watch_state import apply_actions, describe_action, diff_actions, plan_actions
+
+# Bulk apply: concurrent workers share one pooled session behind a token-bucket rate limit
+IMPORT_WORKERS = 8
+IMPORT_RATE_PER_SECOND = 25
+
+def choose(options, heading, prompt, error):
+    print(heading)
+    for i, option in enumerate(options, 1):
+        print(f"  {i}. {option}")
+
+    try:
+        return options[int(input(prompt).strip()) - 1]
+    except (ValueError, IndexError):
+        raise ValueError(error)
+
+def confirm(prompt):
+    return input(prompt).strip().lower() == "y"
+
+def open_export(db_file):
+    if not os.path.exists(db_file):
+        raise FileNotFoundError(f"Exported DB not found: {db_file}")
+
+    conn = sqlite3.connect(db_file)
+    # Older exports get the current schema (typed numbers, lookup indexes) before they are queried
+    migrate(conn)
+    return conn
+
+def get_libraries(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT library_section FROM media ORDER BY library_section")]
+
+def get_watch_state(conn, media_map, library):
+    # Watch state of one library, with target items mapped on earlier runs
+    map_join, map_params = media_map.join("media.rating_key")
+    return conn.execute(f"""
+        SELECT media.rating_key, mapping.target_rating_key,
+               media.title, media.year, media.guid, media.file_path,
+               media.view_count, media.view_offset, media.user_rating
+        FROM media
+        {map_join}
+        WHERE media.library_section = ?
+        AND (
+            (media.view_count IS NOT NULL AND media.last_viewed_at IS NOT NULL)
+            OR media.view_offset IS NOT NULL
+            OR media.user_rating IS NOT NULL
+        )
+    """, map_params + (library,)).fetchall()
+
+def import_watch_state(server, db_file, library, dry_run=False, playlists=False, conn=None):
+    # Applies one exported library's watch state to a server; returns the number of failed items
+    base_url, token = get_server_config(server)
+    headers = {'X-Plex-Token': token}
+    conn = conn or open_export(db_file)
+
+    section_key, section_type = None, None
+    for key, title, kind in get_sections(base_url, headers):
+        if title == library:
+            section_key, section_type = key, kind
+            break
+
+    if not section_key:
+        raise RuntimeError(f"Library '{library}' not found on server '{server}'.")
+
+    media_map = MediaMap.for_export(conn, db_file, server)
+    watched = get_watch_state(conn, media_map, library)
+    print(f"📺 Found {len(watched)} items with watch state in '{library}'")
+
+    # === Index the target library once (including its current watch state), then match locally ===
+    print(f"📡 Indexing '{library}' on '{server}'...")
+    index = build_section_index(base_url, headers, section_key, section_type)
+    print(f"🗂️  Indexed {len(index)} items")
+
+    planned = []
+    unchanged = 0
+    not_found = []
+    match_counts = {"map": 0, "guid": 0, "path": 0, "title": 0}
+
+    for source_key, mapped_key, title, year, guid, file_path, view_count, view_offset, user_rating in watched:
+        rating_key, method = media_map.resolve(
+            index, source_key, mapped_key, guid=guid, file_path=file_path, title=title, year=year
+        )
+        if rating_key is None:
+            print(f"🚫 No match found in Plex for: {title}")
+            not_found.append(title)
+            continue
+        match_counts[method] += 1
+
+        # Only send state the target doesn't already have; avoids inflating play counts on re-runs
+        actions = diff_actions(plan_actions(rating_key, view_count, view_offset, user_rating), index.items[rating_key])
+        if actions:
+            planned.append((title, actions))
+        else:
+            unchanged += 1
+
+    # New matches are remembered, so the next run (or playlist restore) joins instead of matching
+    new_mappings = media_map.save()
 
-db_files = sorted(glob.glob("plex_export_*.db"))
-if not db_files:
-    raise FileNotFoundError("No plex_export_*.db files found in current directory.")
-
-print("\nAvailable export DBs:")
-for i, db in enumerate(db_files, 1):
-    print(f"  {i}. {db}")
-
-try:
-    db_choice = int(input("Select a DB to import watch history from: ").strip())
-    DB_FILE = db_files[db_choice - 1]
-except (ValueError, IndexError):
-    raise ValueError("Invalid DB selection.")
-
-if not PLEX_TOKEN or not PLEX_BASE_URL:
-    raise EnvironmentError(f"Missing PLEX_TOKEN_{server} or PLEX_BASE_URL_{server}")
-
-HEADERS = {'X-Plex-Token': PLEX_TOKEN}
-
-# === Connect to Exported DB ===
-if not os.path.exists(DB_FILE):
-    raise FileNotFoundError(f"Exported DB not found: {DB_FILE}")
-
-conn = sqlite3.connect(DB_FILE)
-cur = conn.cursor()
-
-# === Query distinct libraries ===
-cur.execute("SELECT DISTINCT library_section FROM media ORDER BY library_section")
-libraries = [row[0] for row in cur.fetchall()]
-
-print("Available libraries in exported DB:")
-for i, lib in enumerate(libraries, 1):
-    print(f"  {i}. {lib}")
-
-try:
-    lib_choice = int(input("Select a library to import view history into: ").strip())
-    selected_library = libraries[lib_choice - 1]
-except (ValueError, IndexError):
-    raise ValueError("Invalid library selection.")
-
-# === Get Plex library section key ===
-res = requests.get(f"{PLEX_BASE_URL}/library/sections", headers=HEADERS)
-res.raise_for_status()
-sections_xml = ElementTree.fromstring(res.content)
-
-section_key = None
-for el in sections_xml.findall(".//Directory"):
-    if el.attrib.get("title") == selected_library:
-        section_key = el.attrib["key"]
-        break
-
-if not section_key:
-    raise RuntimeError(f"Library '{selected_library}' not found on server '{server}'.")
-
-# === Query watched items from DB for selected library ===
-cur.execute("""
-    SELECT title, last_viewed_at
-    FROM media
-    WHERE library_section = ?
-    AND view_count IS NOT NULL
-    AND last_viewed_at IS NOT NULL
-""", (selected_library,))
-watched = cur.fetchall()
-
-print(f"📺 Found {len(watched)} watched items in '{selected_library}'")
-
-# === Match by title and scrobble ===
-success, failed = 0, 0
-not_found = []
-
-for title, last_viewed_at in watched:
-    escaped = quote(title)
-    search_url = f"{PLEX_BASE_URL}/library/sections/{section_key}/all?title={escaped}"
-    r = requests.get(search_url, headers=HEADERS)
-    r.raise_for_status()
-    xml = ElementTree.fromstring(r.content)
-
-    match = xml.find(".//Video")
-    if match is not None:
-        rating_key = match.attrib.get("ratingKey")
-        scrobble_url = f"{PLEX_BASE_URL}/:/scrobble?key={rating_key}&identifier=com.plexapp.plugins.library"
-        s = requests.get(scrobble_url, headers=HEADERS)
-        if s.status_code == 200:
-            print(f"✔️  Marked watched: {title}")
-            success += 1
+    # === Apply watch state in parallel ===
+    results = apply_actions(
+        base_url, headers, planned,
+        max_workers=IMPORT_WORKERS, rate_per_second=IMPORT_RATE_PER_SECOND, dry_run=dry_run
+    )
+
+    applied = {"scrobble": 0, "progress": 0, "rate": 0}
+    failed = len(not_found)
+
+    for title, action, ok, detail in sorted(results, key=lambda r: r[0] or ""):
+        if ok:
+            prefix = "📝 Would" if dry_run else "✔️ "
+            print(f"{prefix} {describe_action(action)}: {title}")
+            applied[action[0]] += 1
         else:
-            print(f"❌ Failed to scrobble: {title} (status {s.status_code})")
+            print(f"❌ Failed to {describe_action(action)}: {title} ({detail})")
             failed += 1
-    else:
-        print(f"🚫 No match found in Plex for: {title}")
-        not_found.append(title)
-        failed += 1
-
-# === Summary ===
-print("\n===== Import Summary =====")
-print(f"✅ Scrobbled: {success}")
-print(f"❌ Failed or Not Found: {failed}")
-if not_found:
-    print("\n🚫 Titles not found in Plex:")
-    for t in not_found:
-        print(f" - {t}")
+
+    # === Summary ===
+    print("\n===== Import Summary =====" + (" (dry run)" if dry_run else ""))
+    print(f"✅ Scrobbled: {applied['scrobble']}, resume points: {applied['progress']}, ratings: {applied['rate']}")
+    print(f"⏭️  Already up to date: {unchanged}")
+    print(f"❌ Failed or Not Found: {failed}")
+    print(f"🔗 Mapped on earlier runs: {match_counts['map']}, newly matched by guid: {match_counts['guid']}, "
+          f"path: {match_counts['path']}, title: {match_counts['title']} ({new_mappings} mappings saved)")
+    if not_found:
+        print("\n🚫 Titles not found in Plex:")
+        for t in not_found:
+            print(f" - {t}")
+
+    if playlists:
+        restore_playlists(base_url, headers, conn, dry_run=dry_run, media_map=media_map)
+
+    conn.close()
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import exported Plex watch state (and playlists) into a server.")
+    parser.add_argument("--server", help="Target server: the <name> of PLEX_TOKEN_<name>")
+    parser.add_argument("--db", help="Export DB to import from (plex_export_<name>.db)")
+    parser.add_argument("--library", help="Library section to import, as named in the export")
+    parser.add_argument("--dry-run", action="store_true", default=None, help="Show changes without sending them")
+    parser.add_argument("--playlists", action=argparse.BooleanOptionalAction, default=None,
+                        help="Also restore playlists from the export")
+    parser.add_argument("--no-input", action="store_true",
+                        help="Never prompt; missing choices are errors and yes/no questions default to no")
+    args = parser.parse_args(argv)
+
+    # Prompts fill in whatever wasn't given on the command line, unless run unattended (e.g. from cron)
+    interactive = not args.no_input and sys.stdin.isatty()
+
+    def require(value, what):
+        if value is None and not interactive:
+            parser.error(f"--{what} is required when not running interactively")
+
+    server = args.server
+    if server is None:
+        require(server, "server")
+        servers = get_available_servers()
+        if not servers:
+            raise RuntimeError("No PLEX_TOKEN_<server> env vars found.")
+        server = choose(servers, "Available Plex servers:", "Select a Plex server by number: ", "Invalid server selection.")
+
+    db_file = args.db
+    if db_file is None:
+        require(db_file, "db")
+        db_files = sorted(glob.glob("plex_export_*.db"))
+        if not db_files:
+            raise FileNotFoundError("No plex_export_*.db files found in current directory.")
+        db_file = choose(db_files, "\nAvailable export DBs:", "Select a DB to import watch history from: ", "Invalid DB selection.")
+
+    conn = open_export(db_file)
+    library = args.library
+    if library is None:
+        require(library, "library")
+        library = choose(
+            get_libraries(conn), "Available libraries in exported DB:",
+            "Select a library to import view history into: ", "Invalid library selection."
+        )
+
+    dry_run = args.dry_run
+    if dry_run is None:
+        dry_run = interactive and confirm("Dry run (show changes without sending them)? (y/n): ")
+    playlists = args.playlists
+    if playlists is None:
+        playlists = interactive and confirm("\nRestore playlists from this export too? (y/n): ")
+
+    failed = import_watch_state(server, db_file, library, dry_run=dry_run, playlists=playlists, conn=conn)
+    METRICS.log_summary(print)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
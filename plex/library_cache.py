@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+CACHE_PATH = os.getenv("PLEX_CACHE_PATH", os.path.join(script_dir, "plex_library_cache.db"))
+
+# Full refresh after this many hours; in between only changed items are fetched (0 disables the cache)
+try:
+    CACHE_TTL_HOURS = float(os.getenv("PLEX_CACHE_TTL_HOURS", "24"))
+except ValueError:
+    CACHE_TTL_HOURS = 24.0
+
+# Listing type of the leaf items cached per section type
+LEAF_TYPES = {"movie": 1, "show": 4}
+PAGE_SIZE = 2000
+
+Tag = namedtuple("Tag", "tag")
+
+COLUMNS = (
+    "rating_key", "section_key", "type", "title", "year", "originally_available_at", "added_at",
+    "updated_at", "view_count", "last_viewed_at", "grandparent_rating_key", "grandparent_title",
+    "parent_index", "item_index", "guid", "genres"
+)
+
+def to_int(value):
+    return int(value) if value not in (None, "") else None
+
+def to_datetime(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, str) and "-" in value:
+        return datetime.strptime(value[:10], "%Y-%m-%d")
+    return datetime.fromtimestamp(int(value))
+
+class CachedItem:
+    # Lightweight stand-in for a plexapi Video: the attributes the playlist/optimize scripts read,
+    # plus what plexapi's createPlaylist/addItems need (ratingKey, listType, _server)
+    __slots__ = (
+        "_server", "ratingKey", "librarySectionID", "type", "title", "year", "originallyAvailableAt",
+        "addedAt", "updatedAt", "viewCount", "lastViewedAt", "grandparentRatingKey", "grandparentTitle",
+        "parentIndex", "index", "guid", "genres"
+    )
+    listType = "video"
+
+    def __init__(self, server, row):
+        (self.ratingKey, self.librarySectionID, self.type, self.title, self.year, originally_available_at,
+         added_at, updated_at, self.viewCount, last_viewed_at, self.grandparentRatingKey, self.grandparentTitle,
+         self.parentIndex, self.index, self.guid, genres) = row
+        self._server = server
+        self.originallyAvailableAt = to_datetime(originally_available_at)
+        self.addedAt = to_datetime(added_at)
+        self.updatedAt = to_datetime(updated_at)
+        self.lastViewedAt = to_datetime(last_viewed_at)
+        self.genres = [Tag(genre) for genre in json.loads(genres or "[]")]
+
+    @property
+    def isWatched(self):
+        return bool(self.viewCount)
+
+    def fetch(self):
+        # Full plexapi object, for the few items that need more than the cached fields
+        return self._server.fetchItem(self.ratingKey)
+
+    def __repr__(self):
+        return f"<CachedItem {self.ratingKey}:{self.title}>"
+
+def element_row(element, section_key):
+    attrib = element.attrib
+    return (
+        to_int(attrib.get("ratingKey")),
+        section_key,
+        attrib.get("type"),
+        attrib.get("title"),
+        to_int(attrib.get("year")),
+        attrib.get("originallyAvailableAt"),
+        to_int(attrib.get("addedAt")),
+        to_int(attrib.get("updatedAt")),
+        to_int(attrib.get("viewCount")) or 0,
+        to_int(attrib.get("lastViewedAt")),
+        to_int(attrib.get("grandparentRatingKey")),
+        attrib.get("grandparentTitle"),
+        to_int(attrib.get("parentIndex")),
+        to_int(attrib.get("index")),
+        attrib.get("guid"),
+        json.dumps([genre.attrib.get("tag") for genre in element.findall("Genre")]),
+    )
+
+class LibraryCache:
+    def __init__(self, path=CACHE_PATH, ttl_hours=CACHE_TTL_HOURS):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript('''
+        CREATE TABLE IF NOT EXISTS items (
+            rating_key INTEGER PRIMARY KEY,
+            section_key INTEGER,
+            type TEXT,
+            title TEXT,
+            year INTEGER,
+            originally_available_at TEXT,
+            added_at INTEGER,
+            updated_at INTEGER,
+            view_count INTEGER,
+            last_viewed_at INTEGER,
+            grandparent_rating_key INTEGER,
+            grandparent_title TEXT,
+            parent_index INTEGER,
+            item_index INTEGER,
+            guid TEXT,
+            genres TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_items_section ON items (section_key, view_count);
+        CREATE TABLE IF NOT EXISTS sections (
+            section_key INTEGER PRIMARY KEY,
+            refreshed_at REAL,
+            item_count INTEGER
+        );
+        ''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def query_items(self, plex, section_key, leaf_type, extra=""):
+        start = 0
+        while True:
+            xml = plex.query(
+                f"/library/sections/{section_key}/all?type={leaf_type}&includeGuids=1{extra}"
+                f"&X-Plex-Container-Start={start}&X-Plex-Container-Size={PAGE_SIZE}"
+            )
+            elements = xml.findall("Video")
+            yield from elements
+            start += PAGE_SIZE
+            if len(elements) < PAGE_SIZE or start >= int(xml.attrib.get("totalSize", start)):
+                break
+
+    def server_count(self, plex, section_key, leaf_type, extra=""):
+        xml = plex.query(f"/library/sections/{section_key}/all?type={leaf_type}{extra}&X-Plex-Container-Size=0")
+        return int(xml.attrib.get("totalSize", xml.attrib.get("size", 0)))
+
+    def upsert(self, rows):
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO items ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            rows
+        )
+
+    def watermark(self, section_key, column):
+        row = self.conn.execute(f"SELECT MAX({column}) FROM items WHERE section_key = ?", (section_key,)).fetchone()
+        return row[0] or 0
+
+    def cached_count(self, section_key, unwatched=False):
+        query = "SELECT COUNT(*) FROM items WHERE section_key = ?"
+        if unwatched:
+            query += " AND view_count = 0"
+        return self.conn.execute(query, (section_key,)).fetchone()[0]
+
+    def full_refresh(self, plex, section_key, leaf_type):
+        self.conn.execute("DELETE FROM items WHERE section_key = ?", (section_key,))
+        self.upsert(element_row(element, section_key) for element in self.query_items(plex, section_key, leaf_type))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sections (section_key, refreshed_at, item_count) VALUES (?, ?, ?)",
+            (section_key, time.time(), self.cached_count(section_key))
+        )
+        self.conn.commit()
+
+    def refresh(self, plex, section):
+        leaf_type = LEAF_TYPES.get(section.type)
+        if leaf_type is None:
+            return
+        section_key = int(section.key)
+        state = self.conn.execute(
+            "SELECT refreshed_at FROM sections WHERE section_key = ?", (section_key,)
+        ).fetchone()
+
+        if state is None or time.time() - state[0] > self.ttl_seconds:
+            logging.info(f"Library cache: full refresh of '{section.title}'")
+            self.full_refresh(plex, section_key, leaf_type)
+            return
+
+        # Items changed since the last refresh: metadata updates and new plays (server-side timestamps).
+        # Plex's >>= is strictly after, so items stamped in the watermark's own second are fetched again.
+        changed = {}
+        for field, column in (("updatedAt", "updated_at"), ("lastViewedAt", "last_viewed_at")):
+            since = max(self.watermark(section_key, column) - 1, 0)
+            for element in self.query_items(plex, section_key, leaf_type, f"&{field}>>={since}"):
+                changed[element.attrib.get("ratingKey")] = element_row(element, section_key)
+        self.upsert(changed.values())
+        self.conn.commit()
+
+        # Marking an item unwatched touches neither timestamp, and deletions show up in no feed; the
+        # unwatched and total counts catch both, and only a mismatch costs a listing or a full refresh
+        drifted = False
+        if self.cached_count(section_key, unwatched=True) != self.server_count(plex, section_key, leaf_type, "&unwatched=1"):
+            drifted = self.resync_unwatched(plex, section_key, leaf_type, changed)
+        if drifted or self.cached_count(section_key) != self.server_count(plex, section_key, leaf_type):
+            logging.info(f"Library cache: items removed from '{section.title}', doing a full refresh")
+            self.full_refresh(plex, section_key, leaf_type)
+        else:
+            logging.info(f"Library cache: {len(changed)} changed items in '{section.title}'")
+
+    def resync_unwatched(self, plex, section_key, leaf_type, changed):
+        # Upserts items unwatched on the server but cached as watched; returns whether an unwatched
+        # item vanished without being played (i.e. was deleted)
+        cached_unwatched = {
+            row[0] for row in
+            self.conn.execute("SELECT rating_key FROM items WHERE section_key = ? AND view_count = 0", (section_key,))
+        }
+        server_unwatched, rows = set(), []
+        for element in self.query_items(plex, section_key, leaf_type, "&unwatched=1"):
+            row = element_row(element, section_key)
+            server_unwatched.add(row[0])
+            if row[0] not in cached_unwatched:
+                rows.append(row)
+        self.upsert(rows)
+        self.conn.commit()
+        return bool(cached_unwatched - server_unwatched - {row[0] for row in changed.values()})
+
+    def items(self, plex, section, unwatched=False):
+        query = f"SELECT {', '.join(COLUMNS)} FROM items WHERE section_key = ?"
+        if unwatched:
+            query += " AND view_count = 0"
+        return [CachedItem(plex, row) for row in self.conn.execute(query, (int(section.key),))]
+
+def load_section_items(plex, sections, unwatched=False, cache_path=CACHE_PATH):
+    # Refresh the on-disk cache for these sections and return lightweight records
+    cache = LibraryCache(cache_path)
+    try:
+        items = []
+        for section in sections:
+            cache.refresh(plex, section)
+            items += cache.items(plex, section, unwatched=unwatched)
+        return items
+    finally:
+        cache.close()
@@ -0,0 +1,122 @@
+import re
+import unicodedata
+from xml.etree import ElementTree
+
+from plex_client import shared_session
+
+# Listing type that returns leaf items directly (movies, episodes, tracks) instead of shows/artists
+LEAF_TYPES = {"movie": 1, "show": 4, "artist": 10}
+
+def normalize_title(title):
+    if not title:
+        return ""
+    title = unicodedata.normalize("NFKD", title)
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = re.sub(r"[^\w\s]", " ", title.lower())
+    return " ".join(title.split())
+
+def normalize_path(file_path):
+    if not file_path:
+        return ""
+    return file_path.replace("\\", "/").lower()
+
+def path_tail(file_path):
+    # Parent folder + file name survives different mount points between servers
+    parts = normalize_path(file_path).rsplit("/", 2)
+    return "/".join(parts[-2:])
+
+def parse_year(value):
+    try:
+        return int(str(value)[:4])
+    except (TypeError, ValueError):
+        return None
+
+def get_sections(base_url, headers):
+    res = shared_session(headers).get(f"{base_url}/library/sections")
+    res.raise_for_status()
+    xml = ElementTree.fromstring(res.content)
+    return [
+        (el.attrib["key"], el.attrib.get("title"), el.attrib.get("type"))
+        for el in xml.findall(".//Directory")
+    ]
+
+def fetch_section_items(base_url, headers, section_key, section_type, extra=""):
+    # extra: additional query filters, e.g. "&lastViewedAt>>=1700000000"
+    leaf_type = LEAF_TYPES.get(section_type)
+    if leaf_type is None:
+        return []
+    url = f"{base_url}/library/sections/{section_key}/all?type={leaf_type}&includeGuids=1{extra}"
+    res = shared_session(headers).get(url)
+    res.raise_for_status()
+    xml = ElementTree.fromstring(res.content)
+    return xml.findall(".//Video") + xml.findall(".//Track")
+
+class MediaIndex:
+    def __init__(self):
+        self.items = {}
+        self.by_guid = {}
+        self.by_path = {}
+        self.by_path_tail = {}
+        self.by_title_year = {}
+
+    def add(self, element):
+        attrib = element.attrib
+        rating_key = attrib.get("ratingKey")
+        if not rating_key:
+            return
+        self.items[rating_key] = attrib
+
+        guids = [attrib.get("guid")] + [g.attrib.get("id") for g in element.findall("Guid")]
+        for guid in filter(None, guids):
+            self.by_guid.setdefault(guid, rating_key)
+
+        for part in element.findall("Media/Part"):
+            file_path = part.attrib.get("file")
+            if file_path:
+                self.by_path.setdefault(normalize_path(file_path), rating_key)
+                self.by_path_tail.setdefault(path_tail(file_path), set()).add(rating_key)
+
+        title = normalize_title(attrib.get("title"))
+        if title:
+            year = parse_year(attrib.get("year") or attrib.get("originallyAvailableAt"))
+            self.by_title_year.setdefault((title, year), set()).add(rating_key)
+            self.by_title_year.setdefault((title, None), set()).add(rating_key)
+
+    def match(self, guid=None, file_path=None, title=None, year=None):
+        # Returns (rating_key, method); guid wins, then file path, then an unambiguous title(+year)
+        if guid and guid in self.by_guid:
+            return self.by_guid[guid], "guid"
+
+        if file_path:
+            rating_key = self.by_path.get(normalize_path(file_path))
+            if rating_key:
+                return rating_key, "path"
+            candidates = self.by_path_tail.get(path_tail(file_path), set())
+            if len(candidates) == 1:
+                return next(iter(candidates)), "path"
+
+        if title:
+            # Title and year first; a unique title still matches when the year is missing or differs
+            title = normalize_title(title)
+            for key in dict.fromkeys(((title, parse_year(year)), (title, None))):
+                candidates = self.by_title_year.get(key, set())
+                if len(candidates) == 1:
+                    return next(iter(candidates)), "title"
+
+        return None, None
+
+    def __len__(self):
+        return len(self.items)
+
+def build_section_index(base_url, headers, section_key, section_type):
+    index = MediaIndex()
+    for element in fetch_section_items(base_url, headers, section_key, section_type):
+        index.add(element)
+    return index
+
+def build_server_index(base_url, headers):
+    index = MediaIndex()
+    for section_key, _, section_type in get_sections(base_url, headers):
+        for element in fetch_section_items(base_url, headers, section_key, section_type):
+            index.add(element)
+    return index
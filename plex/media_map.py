@@ -0,0 +1,87 @@
+import os
+import time
+
+# Source -> target item correspondence, kept in one DB next to the export DBs and shared by
+# every (export, target server) pair, so later syncs reuse earlier matches
+MAP_DB_NAME = "plex_media_map.db"
+
+def map_db_path(export_db):
+    return os.path.join(os.path.dirname(os.path.abspath(export_db)), MAP_DB_NAME)
+
+def source_server_name(export_db):
+    name = os.path.splitext(os.path.basename(export_db))[0]
+    return name[len("plex_export_"):] if name.startswith("plex_export_") else name
+
+class MediaMap:
+    # Attached to the export DB connection as "media_map", so stored mappings come back as an
+    # indexed join on the source rating key (see JOIN) instead of being re-matched every run
+    JOIN = """
+        LEFT JOIN media_map.mappings AS mapping
+        ON mapping.source_server = ? AND mapping.target_server = ? AND mapping.source_rating_key = {key}
+    """
+
+    def __init__(self, conn, source_server, target_server, path):
+        self.conn = conn
+        self.source_server = source_server
+        self.target_server = target_server
+        self.pending = []
+        self.reused = 0
+
+        # One attachment per connection, shared by every server pair using it
+        if "media_map" not in {row[1] for row in conn.execute("PRAGMA database_list")}:
+            conn.execute("ATTACH DATABASE ? AS media_map", (path,))
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS media_map.mappings (
+            source_server TEXT,
+            source_rating_key TEXT,
+            target_server TEXT,
+            target_rating_key TEXT,
+            method TEXT,
+            mapped_at INTEGER,
+            PRIMARY KEY (source_server, source_rating_key, target_server)
+        )
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS media_map.idx_mappings_target ON mappings (target_server, target_rating_key)"
+        )
+        conn.commit()
+
+    @classmethod
+    def for_export(cls, conn, export_db, target_server):
+        return cls(conn, source_server_name(export_db), target_server, map_db_path(export_db))
+
+    def join(self, key_column):
+        # SQL fragment and its parameters; the query can then select mapping.target_rating_key
+        return self.JOIN.format(key=key_column), (self.source_server, self.target_server)
+
+    def lookup(self, source_key):
+        row = self.conn.execute('''
+            SELECT target_rating_key FROM media_map.mappings
+            WHERE source_server = ? AND target_server = ? AND source_rating_key = ?
+        ''', (self.source_server, self.target_server, str(source_key))).fetchone()
+        return row[0] if row else None
+
+    def resolve(self, index, source_key, mapped_key, guid=None, file_path=None, title=None, year=None):
+        # The stored mapping while its target still exists; otherwise match against the index and
+        # queue the result for save(). Returns (target rating key, method) or (None, None).
+        if mapped_key is not None and mapped_key in index.items:
+            self.reused += 1
+            return mapped_key, "map"
+
+        rating_key, method = index.match(guid=guid, file_path=file_path, title=title, year=year)
+        if rating_key is not None and source_key:
+            self.pending.append((
+                self.source_server, str(source_key), self.target_server, rating_key, method, int(time.time())
+            ))
+        return rating_key, method
+
+    def save(self):
+        if self.pending:
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO media_map.mappings
+                (source_server, source_rating_key, target_server, target_rating_key, method, mapped_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', self.pending)
+            self.conn.commit()
+        saved, self.pending = len(self.pending), []
+        return saved
@@ -1,9 +1,14 @@
 import os
+import sys
+import time
+import heapq
 import logging
+import argparse
 from datetime import datetime
-from plexapi import BASE_HEADERS
-from plexapi.server import PlexServer
-from plexapi.exceptions import BadRequest
+
+from library_cache import CACHE_TTL_HOURS, load_section_items
+from plex_client import METRICS, connect
+from up_next import load_watch_history, rank_up_next
 
 # Environment variables
 PLEX_URL = os.environ.get("PLEX_URL")
@@ -13,26 +18,30 @@ PLEX_TOKEN = os.environ.get("PLEX_TOKEN")
 LIBRARY_NAMES = ["My Movies", "My TV Shows", "YouTube"]
 MAX_ITEMS_TO_OPTIMIZE = 10
 OPTIMIZATION_TARGET = "Mobile"
+CLEANUP_BATCH_SIZE = 200
 
-# Logging
-logfile_path = os.path.join(os.path.dirname(__file__), "optimize_items.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(logfile_path, mode='w'),
-        logging.StreamHandler()
-    ]
-)
-
-def get_plex_server():
-    client_identifier = os.getenv("PLEX_CLIENT_IDENTIFIER", "optimize-items-script")
+# Scheduler: keep this many conversions queued/running, stay out of the way of live transcodes,
+# and keep optimized versions within a disk budget (estimated at the Mobile bitrate)
+TARGET_JOBS_IN_FLIGHT = int(os.getenv("OPTIMIZE_TARGET_JOBS", "4"))
+MAX_LIVE_TRANSCODES = int(os.getenv("OPTIMIZE_MAX_LIVE_TRANSCODES", "2"))
+DISK_BUDGET_BYTES = float(os.getenv("OPTIMIZE_DISK_BUDGET_GB", "200")) * 1024**3
+MOBILE_BITRATE_KBPS = 4000
+# Seconds between scheduler passes; 0 runs a single pass
+INTERVAL_SECONDS = int(os.getenv("OPTIMIZE_INTERVAL_SECONDS", "0"))
 
-    BASE_HEADERS['X-Plex-Client-Identifier'] = client_identifier
-    BASE_HEADERS['X-Plex-Product'] = "OptimizeItems"
-    BASE_HEADERS['X-Plex-Version'] = "1.0"
+def setup_logging():
+    logfile_path = os.path.join(os.path.dirname(__file__), "optimize_items.log")
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.FileHandler(logfile_path, mode='w'),
+            logging.StreamHandler()
+        ]
+    )
 
-    return PlexServer(PLEX_URL, PLEX_TOKEN)
+def get_plex_server():
+    return connect(PLEX_URL, PLEX_TOKEN, "OptimizeItems", "optimize-items-script")
 
 def has_mobile_optimized_versions(item):
     try:
@@ -50,43 +59,103 @@ def has_mobile_optimized_versions(item):
 def get_sort_key(item):
     return getattr(item, 'originallyAvailableAt', None) or getattr(item, 'addedAt', None) or datetime.now()
 
-def collect_items_to_optimize(plex):
-    items_to_optimize = []
+def search_candidates(section, limit):
+    # One section-level query, sorted server-side and capped at the number of items still needed
+    libtype = "episode" if section.type == "show" else "movie"
+    return section.search(
+        libtype=libtype, unwatched=True, sort="originallyAvailableAt:asc",
+        maxresults=limit, container_size=limit
+    )
+
+def is_candidate(item, skip_keys):
+    return (
+        item.ratingKey not in skip_keys
+        and getattr(item, 'librarySectionTitle', None) in LIBRARY_NAMES
+        and item.type in ("movie", "episode")
+        and not item.isWatched
+    )
 
+def get_library_sections(plex):
+    sections = []
     for library_name in LIBRARY_NAMES:
         try:
             section = plex.library.section(library_name)
         except Exception as e:
             logging.warning(f"Could not access section '{library_name}': {e}")
             continue
+        if section.type in ("movie", "show"):
+            sections.append(section)
+    return sections
+
+def get_on_deck_candidates(plex, limit, skip_keys):
+    # On Deck is the server's own prediction of what plays next: next episodes of in-progress
+    # shows and partially watched items
+    try:
+        return [item for item in plex.library.onDeck() if is_candidate(item, skip_keys)][:limit]
+    except Exception as e:
+        logging.warning(f"Could not load On Deck: {e}")
+        return []
+
+def collect_from_cache(plex, sections, limit, skip_keys):
+    # On Deck stays first: the cache has no resume points, and without an export DB the history
+    # ranking below can't tell which items are partially watched
+    on_deck = get_on_deck_candidates(plex, limit, skip_keys)
+    skip_keys = skip_keys | {item.ratingKey for item in on_deck}
+    limit -= len(on_deck)
+
+    # Movies/episodes come from the on-disk library cache as lightweight records; watched ones locate
+    # each show's position for the up-next ranking. Only the chosen items are loaded as plexapi objects.
+    cached = load_section_items(plex, sections)
+    chosen = [item for item in rank_up_next(cached, load_watch_history()) if item.ratingKey not in skip_keys][:limit]
+    logging.info(f"{len(on_deck)} On Deck items, {len(chosen)} up-next items ranked from watch history")
+
+    # Oldest unwatched items fill the remaining slots
+    skip_keys = skip_keys | {item.ratingKey for item in chosen}
+    for section in sections:
+        remaining = limit - len(chosen)
+        if remaining <= 0:
+            break
+        unwatched = [
+            item for item in cached
+            if item.librarySectionID == int(section.key) and not item.isWatched and item.ratingKey not in skip_keys
+        ]
+        chosen.extend(heapq.nsmallest(remaining, unwatched, key=get_sort_key))
+
+    return on_deck + [item.fetch() for item in chosen]
+
+def collect_from_server(plex, sections, limit, skip_keys):
+    items_to_optimize = get_on_deck_candidates(plex, limit, skip_keys)
+    skip_keys = skip_keys | {item.ratingKey for item in items_to_optimize}
+
+    for section in sections:
+        remaining = limit - len(items_to_optimize)
+        if remaining <= 0:
+            break
 
         try:
-            if section.type == "movie":
-                items = section.search(unwatched=True)
-            elif section.type == "show":
-                items = []
-                for show in section.all():
-                    try:
-                        episodes = show.episodes(unwatched=True)
-                        items.extend(episodes)
-                    except Exception as e:
-                        logging.warning(f"Could not get episodes for show '{show.title}': {e}")
-            else:
-                continue
+            candidates = search_candidates(section, remaining + len(skip_keys))
         except Exception as e:
-            logging.warning(f"Failed to retrieve items for section '{library_name}': {e}")
+            logging.warning(f"Failed to retrieve items for section '{section.title}': {e}")
             continue
 
-        sorted_items = sorted(items, key=get_sort_key)
-
-        for item in sorted_items:
-            if len(items_to_optimize) >= MAX_ITEMS_TO_OPTIMIZE:
-                return items_to_optimize
-            items_to_optimize.append(item)
+        candidates = [item for item in candidates if item.ratingKey not in skip_keys]
+        items_to_optimize.extend(sorted(candidates, key=get_sort_key)[:remaining])
 
     return items_to_optimize
 
+def collect_items_to_optimize(plex, limit=MAX_ITEMS_TO_OPTIMIZE, skip_keys=()):
+    skip_keys = set(skip_keys)
+    sections = get_library_sections(plex)
+    if CACHE_TTL_HOURS > 0:
+        try:
+            return collect_from_cache(plex, sections, limit, skip_keys)
+        except Exception as e:
+            logging.warning(f"Library cache unavailable, querying server: {e}")
+    return collect_from_server(plex, sections, limit, skip_keys)
+
 def optimize_items(items):
+    from plexapi.exceptions import BadRequest
+
     for item in items:
         try:
             item.optimize(target=OPTIMIZATION_TARGET)
@@ -99,46 +168,146 @@ def optimize_items(items):
         except Exception as e:
             logging.error(f"Failed to optimize '{item.title}': {e}")
 
-def cleanup_optimized_versions(plex):
-    for library_name in LIBRARY_NAMES:
+def is_mobile_target(optimized):
+    # Only optimizations explicitly made for Mobile are ours to clean up; one without a target is left alone
+    labels = f"{optimized.target or ''} {optimized.title or ''}".lower()
+    return OPTIMIZATION_TARGET.lower() in labels or "mobile" in labels
+
+def load_optimized_items(plex):
+    # Start from the server's optimized-items list, so cost scales with what has been optimized.
+    # Returns [(optimize request, its items)] and current metadata of those items by ratingKey.
+    try:
+        generators = [generator for generator in plex.optimizedItems() if is_mobile_target(generator)]
+    except Exception as e:
+        logging.warning(f"Could not list optimized items: {e}")
+        return [], {}
+
+    generator_items = []
+    for generator in generators:
         try:
-            section = plex.library.section(library_name)
+            generator_items.append((generator, generator.items()))
         except Exception as e:
-            logging.warning(f"Could not access section '{library_name}' for cleanup: {e}")
+            logging.warning(f"Could not list items of optimized item '{generator.title}': {e}")
+
+    # Current watched state and media in bulk: one metadata request per batch of rating keys
+    rating_keys = sorted({item.ratingKey for _, items in generator_items for item in items})
+    current = {}
+    for i in range(0, len(rating_keys), CLEANUP_BATCH_SIZE):
+        try:
+            for item in plex.fetchItems(rating_keys[i:i + CLEANUP_BATCH_SIZE]):
+                current[item.ratingKey] = item
+        except Exception as e:
+            logging.warning(f"Failed to load optimized items: {e}")
+
+    return generator_items, current
+
+def cleanup_optimized_versions(generator_items, current):
+    # Returns the rating keys whose optimized versions were removed
+    cleaned = set()
+    if not current:
+        logging.info("No optimized items to clean up")
+        return cleaned
+
+    for generator, items in generator_items:
+        watched = [
+            current[item.ratingKey] for item in items
+            if item.ratingKey in current
+            and current[item.ratingKey].librarySectionTitle in LIBRARY_NAMES
+            and current[item.ratingKey].isWatched
+        ]
+        if not watched:
             continue
 
         try:
-            if section.type == "movie":
-                items = section.search()
-            elif section.type == "show":
-                items = []
-                for show in section.all():
-                    try:
-                        episodes = show.episodes()
-                        items.extend(episodes)
-                    except Exception as e:
-                        logging.warning(f"Could not get episodes for show '{show.title}': {e}")
-            else:
+            if len(watched) == len(items):
+                # Everything in this optimize request is watched: drop the request and its versions
+                generator.remove()
+                cleaned |= {item.ratingKey for item in watched}
+                logging.info(f"Removed optimized item: {generator.title}")
                 continue
+
+            for item in watched:
+                for version in has_mobile_optimized_versions(item):
+                    version.delete()
+                    logging.info(f"Deleted optimized version for: {item.title}")
+                cleaned.add(item.ratingKey)
         except Exception as e:
-            logging.warning(f"Failed to retrieve items for cleanup in section '{library_name}': {e}")
-            continue
+            logging.warning(f"Failed to cleanup optimized version for '{generator.title}': {e}")
+
+    return cleaned
+
+def optimized_disk_usage(current, cleaned):
+    return sum(
+        part.size or 0
+        for rating_key, item in current.items() if rating_key not in cleaned
+        for media in has_mobile_optimized_versions(item)
+        for part in media.parts
+    )
+
+def estimate_optimized_size(item):
+    return (item.duration or 0) / 1000 * MOBILE_BITRATE_KBPS * 125
+
+def available_slots(plex):
+    # Free conversion slots, or none while viewers are being transcoded live
+    try:
+        live = len(plex.transcodeSessions())
+        queued = len(plex.conversions())
+    except Exception as e:
+        logging.warning(f"Could not read transcoder state: {e}")
+        return 0
+
+    if live >= MAX_LIVE_TRANSCODES:
+        logging.info(f"{live} live transcodes running; not scheduling optimizations")
+        return 0
+
+    slots = max(0, min(MAX_ITEMS_TO_OPTIMIZE, TARGET_JOBS_IN_FLIGHT - queued))
+    logging.info(f"Conversion queue: {queued} in flight, {slots} free slots (target {TARGET_JOBS_IN_FLIGHT})")
+    return slots
+
+def apply_disk_budget(items, used_bytes):
+    scheduled = []
+    for item in items:
+        estimate = estimate_optimized_size(item)
+        if used_bytes + estimate > DISK_BUDGET_BYTES:
+            logging.info(
+                f"Disk budget reached ({used_bytes / 1024**3:.1f} of {DISK_BUDGET_BYTES / 1024**3:.0f} GB); "
+                f"not scheduling '{item.title}'"
+            )
+            break
+        used_bytes += estimate
+        scheduled.append(item)
+    return scheduled
+
+def run_pass(plex):
+    # Cleanup first so freed space counts towards this pass's budget
+    generator_items, current = load_optimized_items(plex)
+    cleaned = cleanup_optimized_versions(generator_items, current)
+    used_bytes = optimized_disk_usage(current, cleaned)
+
+    slots = available_slots(plex)
+    if not slots:
+        return
+
+    already_optimized = set(current) - cleaned
+    candidates = collect_items_to_optimize(plex, slots, already_optimized)
+    optimize_items(apply_disk_budget(candidates, used_bytes))
 
-        for item in items:
-            try:
-                if item.isWatched:
-                    for version in has_mobile_optimized_versions(item):
-                        version.delete()
-                        logging.info(f"Deleted optimized version for: {item.title}")
-            except Exception as e:
-                logging.warning(f"Failed to cleanup optimized version for '{item.title}': {e}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue Mobile optimizations and clean up watched ones.")
+    parser.add_argument("--interval", type=int, default=INTERVAL_SECONDS,
+                        help="Seconds between scheduler passes; 0 runs a single pass")
+    args = parser.parse_args(argv)
 
-def main():
+    setup_logging()
     logging.info("Script started: optimize_items.py")
     plex = get_plex_server()
-    items_to_optimize = collect_items_to_optimize(plex)
-    optimize_items(items_to_optimize)
-    cleanup_optimized_versions(plex)
+    while True:
+        run_pass(plex)
+        METRICS.log_summary()
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+from datetime import date, datetime
+
+from export_schema import to_float, to_int
+
+# Typed columnar copies of a plex_export_<name>.db, one Parquet file per table per export:
+#   <out_dir>/<table>/<server>_<timestamp>.parquet
+# Every row carries its server and export time, so a directory of exports from several servers
+# and snapshots reads back as one dataset (pyarrow.dataset.dataset(f"{out_dir}/media")).
+
+# Column name -> Arrow type name; "dictionary" columns are low-cardinality strings stored
+# dictionary-encoded, "timestamp" columns are Plex epoch seconds, "date" columns YYYY-MM-DD strings
+TABLE_SCHEMAS = {
+    "media": {
+        "rating_key": "int64",
+        "title": "string",
+        "library_section": "dictionary",
+        "guid": "dictionary",
+        "file_path": "string",
+        "duration": "int64",
+        "view_count": "int32",
+        "last_viewed_at": "timestamp",
+        "view_offset": "int64",
+        "user_rating": "float32",
+        "year": "int32",
+    },
+    "playlists": {
+        "rating_key": "int64",
+        "title": "string",
+        "playlist_type": "dictionary",
+        "leaf_count": "int32",
+        "smart": "bool",
+        "duration": "int64",
+        "added_at": "timestamp",
+        "updated_at": "timestamp",
+        "summary": "string",
+    },
+    "playlist_items": {
+        "playlist_rating_key": "int64",
+        "item_rating_key": "int64",
+        "item_guid": "dictionary",
+        "item_title": "string",
+        "item_type": "dictionary",
+        "file_path": "string",
+        "view_count": "int32",
+        "last_viewed_at": "timestamp",
+        "view_offset": "int64",
+        "user_rating": "float32",
+        "added_at": "timestamp",
+        "originally_available_at": "date",
+    },
+}
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow. Install it with: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+def to_timestamp(value):
+    # Epoch seconds go straight into timestamp("s") columns; 0 means never
+    return to_int(value) or None
+
+def to_date(value):
+    if value in (None, ""):
+        return None
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+CONVERTERS = {
+    "int64": to_int,
+    "int32": to_int,
+    "float32": to_float,
+    "bool": lambda value: bool(to_int(value)) if value not in (None, "") else None,
+    "timestamp": to_timestamp,
+    "date": to_date,
+    "string": lambda value: None if value is None else str(value),
+    "dictionary": lambda value: None if value in (None, "") else str(value),
+}
+
+def arrow_column(pa, kind, values):
+    if kind == "dictionary":
+        return pa.array(values, type=pa.string()).dictionary_encode()
+    arrow_type = {
+        "int64": pa.int64(),
+        "int32": pa.int32(),
+        "float32": pa.float32(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("s"),
+        "date": pa.date32(),
+        "string": pa.string(),
+    }[kind]
+    return pa.array(values, type=arrow_type)
+
+def table_to_arrow(pa, conn, table, server_name, exported_at):
+    schema = TABLE_SCHEMAS[table]
+    columns = list(schema)
+    rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall()
+
+    arrays = {}
+    for index, column in enumerate(columns):
+        kind = schema[column]
+        arrays[column] = arrow_column(pa, kind, [CONVERTERS[kind](row[index]) for row in rows])
+    arrays["server"] = pa.array([server_name] * len(rows), type=pa.string()).dictionary_encode()
+    arrays["exported_at"] = pa.array([exported_at] * len(rows), type=pa.timestamp("s"))
+    return pa.table(arrays)
+
+def export_parquet(db_file, out_dir, server_name, exported_at=None):
+    # Returns the paths written; tables missing from the DB (e.g. no playlists yet) are skipped
+    pa, pq = require_pyarrow()
+    exported_at = (exported_at or datetime.now()).replace(microsecond=0)
+
+    conn = sqlite3.connect(db_file)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        written = []
+        for table in TABLE_SCHEMAS:
+            if table not in tables:
+                continue
+            arrow_table = table_to_arrow(pa, conn, table, server_name, exported_at)
+            table_dir = os.path.join(out_dir, table)
+            os.makedirs(table_dir, exist_ok=True)
+            path = os.path.join(table_dir, f"{server_name}_{exported_at:%Y%m%dT%H%M%S}.parquet")
+            pq.write_table(arrow_table, path, compression="zstd")
+            written.append(path)
+        return written
+    finally:
+        conn.close()
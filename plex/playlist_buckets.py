@@ -0,0 +1,62 @@
+import logging
+
+def fetch_unwatched_snapshot(movies_section, tv_shows_section, youtube_section=None):
+    # One unwatched query per section; every bucket family is derived from this list
+    items = movies_section.search(unwatched=True)
+    items += tv_shows_section.searchEpisodes(unwatched=True)
+    if youtube_section:
+        try:
+            items += youtube_section.search(unwatched=True)
+        except Exception as e:
+            logging.error(f"Error searching YouTube videos: {e}")
+    return items
+
+def item_year(item):
+    if getattr(item, 'year', None):
+        return item.year
+    if getattr(item, 'originallyAvailableAt', None):
+        return item.originallyAvailableAt.year
+    return None
+
+# Bucket functions map an item to the labels it belongs to (an item may land in several buckets)
+def by_year(item):
+    year = item_year(item)
+    return [str(year)] if year else []
+
+def by_decade(item):
+    year = item_year(item)
+    return [f"{year - year % 10}s"] if year else []
+
+def by_genre(item):
+    return [genre.tag for genre in getattr(item, 'genres', None) or []]
+
+def by_added_month(item):
+    added_at = getattr(item, 'addedAt', None)
+    return [added_at.strftime("%Y-%m")] if added_at else []
+
+def is_year_label(label):
+    return label.isdigit()
+
+def is_decade_label(label):
+    return label.endswith("s") and label[:-1].isdigit()
+
+def group_items(items, bucket_func):
+    buckets = {}
+    for item in items:
+        for label in bucket_func(item):
+            buckets.setdefault(label, []).append(item)
+    return buckets
+
+def group_snapshot(items, bucket_funcs):
+    # bucket_funcs: {family name: bucket function}; returns {family name: {label: items}}
+    return {family: group_items(items, bucket_func) for family, bucket_func in bucket_funcs.items()}
+
+def existing_bucket_labels(playlists, suffix, is_label):
+    # Labels of playlists this script owns, so buckets that emptied out still get cleaned up
+    labels = set()
+    for playlist in playlists:
+        if playlist.title.endswith(suffix):
+            label = playlist.title[:-len(suffix)]
+            if is_label(label):
+                labels.add(label)
+    return labels
@@ -0,0 +1,146 @@
+from xml.etree import ElementTree
+
+from media_index import build_server_index
+from plex_client import make_session
+from watch_state import LIBRARY_IDENTIFIER
+
+# Rating keys per multi-item URI; keeps request URLs well under server limits
+PLAYLIST_BATCH_SIZE = 500
+
+def library_uri(machine_identifier, rating_keys):
+    return f"server://{machine_identifier}/{LIBRARY_IDENTIFIER}/library/metadata/{','.join(rating_keys)}"
+
+def get_machine_identifier(session, base_url):
+    res = session.get(f"{base_url}/")
+    res.raise_for_status()
+    return ElementTree.fromstring(res.content).attrib["machineIdentifier"]
+
+def get_existing_playlists(session, base_url):
+    res = session.get(f"{base_url}/playlists")
+    res.raise_for_status()
+    xml = ElementTree.fromstring(res.content)
+    return {pl.attrib.get("title"): pl.attrib for pl in xml.findall(".//Playlist")}
+
+def get_playlist_item_keys(session, base_url, playlist_key):
+    res = session.get(f"{base_url}/playlists/{playlist_key}/items")
+    res.raise_for_status()
+    xml = ElementTree.fromstring(res.content)
+    return [el.attrib.get("ratingKey") for el in xml if el.attrib.get("ratingKey")]
+
+def create_playlist(session, base_url, machine_identifier, title, playlist_type, rating_keys):
+    params = {
+        "type": playlist_type,
+        "title": title,
+        "smart": 0,
+        "uri": library_uri(machine_identifier, rating_keys),
+    }
+    res = session.post(f"{base_url}/playlists", params=params)
+    res.raise_for_status()
+    return ElementTree.fromstring(res.content).find(".//Playlist").attrib["ratingKey"]
+
+def add_playlist_items(session, base_url, machine_identifier, playlist_key, rating_keys):
+    params = {"uri": library_uri(machine_identifier, rating_keys)}
+    res = session.put(f"{base_url}/playlists/{playlist_key}/items", params=params)
+    res.raise_for_status()
+
+def load_exported_playlists(conn, media_map=None):
+    # Items are (source rating key, mapped target rating key or None, guid, file path, title)
+    cur = conn.cursor()
+    tables = {row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if not {"playlists", "playlist_items"} <= tables:
+        return []
+
+    playlists = []
+    for rating_key, title, playlist_type, smart in cur.execute(
+        "SELECT rating_key, title, playlist_type, smart FROM playlists ORDER BY title"
+    ).fetchall():
+        # playlist_items has no position column; rowid preserves the exported order
+        if media_map is not None:
+            map_join, map_params = media_map.join("item.item_rating_key")
+            mapped_key = "mapping.target_rating_key"
+        else:
+            map_join, map_params, mapped_key = "", (), "NULL"
+        items = cur.execute(f"""
+            SELECT item.item_rating_key, {mapped_key}, item.item_guid, item.file_path, item.item_title,
+                   item.originally_available_at
+            FROM playlist_items AS item
+            {map_join}
+            WHERE item.playlist_rating_key = ?
+            ORDER BY item.rowid
+        """, map_params + (rating_key,)).fetchall()
+        playlists.append((title, playlist_type, bool(smart), items))
+    return playlists
+
+def restore_playlists(base_url, headers, conn, dry_run=False, media_map=None):
+    playlists = load_exported_playlists(conn, media_map)
+    if not playlists:
+        print("⚠️ No exported playlists found in this DB.")
+        return
+
+    print(f"📡 Indexing all libraries for {len(playlists)} playlists...")
+    index = build_server_index(base_url, headers)
+    print(f"🗂️  Indexed {len(index)} items")
+
+    session = make_session(headers, 1)
+    machine_identifier = get_machine_identifier(session, base_url)
+    existing = get_existing_playlists(session, base_url)
+    created, updated, unresolved = 0, 0, 0
+
+    for title, playlist_type, smart, items in playlists:
+        if smart:
+            print(f"⏭️  Skipping smart playlist: '{title}'")
+            continue
+
+        # Ordered as in the export, de-duplicated through the set
+        rating_keys, seen = [], set()
+        for source_key, mapped_key, guid, file_path, item_title, released in items:
+            # match() takes the year from a YYYY-MM-DD release date too
+            if media_map is not None:
+                rating_key, _ = media_map.resolve(
+                    index, source_key, mapped_key, guid=guid, file_path=file_path, title=item_title, year=released
+                )
+            else:
+                rating_key, _ = index.match(guid=guid, file_path=file_path, title=item_title, year=released)
+            if rating_key is None:
+                unresolved += 1
+            elif rating_key not in seen:
+                seen.add(rating_key)
+                rating_keys.append(rating_key)
+
+        if title in existing:
+            playlist_key = existing[title].get("ratingKey")
+            present = set(get_playlist_item_keys(session, base_url, playlist_key))
+            rating_keys = [key for key in rating_keys if key not in present]
+        else:
+            playlist_key = None
+
+        if not rating_keys:
+            if playlist_key:
+                print(f"✔️  Playlist '{title}' is up to date ({len(items)} exported items)")
+            else:
+                print(f"🚫 No items of playlist '{title}' found in Plex")
+            continue
+
+        if dry_run:
+            action = "append" if playlist_key else "create with"
+            print(f"📝 Would {action} {len(rating_keys)} items: '{title}'")
+            continue
+
+        try:
+            for i in range(0, len(rating_keys), PLAYLIST_BATCH_SIZE):
+                batch = rating_keys[i:i + PLAYLIST_BATCH_SIZE]
+                if playlist_key is None:
+                    playlist_key = create_playlist(session, base_url, machine_identifier, title, playlist_type, batch)
+                    created += 1
+                else:
+                    add_playlist_items(session, base_url, machine_identifier, playlist_key, batch)
+            if title in existing:
+                updated += 1
+            print(f"✅ Restored playlist '{title}' ({len(rating_keys)} items added)")
+        except Exception as e:
+            print(f"❌ Failed to restore playlist '{title}': {e}")
+
+    session.close()
+    if media_map is not None:
+        media_map.save()
+    print(f"\n🎶 Playlists created: {created}, updated: {updated}, unresolved items: {unresolved}")
@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+class AdaptivePacer:
+    # Paces playlist writes by measured latency instead of a fixed sleep: fast responses grow
+    # the batch size and drop the delay, slow or failed responses shrink it and back off
+    def __init__(self, batch_size=500, min_batch_size=50, max_batch_size=1000,
+                 target_seconds=2.0, max_delay=30.0):
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_seconds = target_seconds
+        self.max_delay = max_delay
+        self.delay = 0.0
+        # Shared by concurrent playlist workers
+        self.lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        if self.delay:
+            time.sleep(self.delay)
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.back_off()
+            raise
+        self.record(time.monotonic() - started)
+        return result
+
+    def record(self, elapsed):
+        if elapsed > self.target_seconds:
+            self.back_off()
+        elif elapsed < self.target_seconds / 2:
+            with self.lock:
+                self.batch_size = min(self.max_batch_size, int(self.batch_size * 1.5))
+                self.delay = self.delay / 2 if self.delay > 0.05 else 0.0
+
+    def back_off(self):
+        with self.lock:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self.delay = min(self.max_delay, max(self.delay * 2, 0.5))
+        logging.debug(f"Slowing playlist writes: batch size {self.batch_size}, delay {self.delay:.2f}s")
+
+    def batches(self, items):
+        # Batch size is re-read after every batch so it tracks the latest measurement
+        start = 0
+        while start < len(items):
+            batch = items[start:start + self.batch_size]
+            start += len(batch)
+            yield batch
+
+def playlist_sort_key(item):
+    return item.originallyAvailableAt or item.addedAt
+
+def sorted_playlist_items(items):
+    # Chronological, one entry per ratingKey
+    unique = {}
+    for item in items:
+        unique.setdefault(item.ratingKey, item)
+    return sorted(unique.values(), key=playlist_sort_key)
+
+def diff_playlist(current_items, desired_items):
+    # O(n) diff keyed by ratingKey; items_to_add keeps the desired order, and duplicate
+    # entries already in the playlist are removed so each item appears once
+    desired_keys = {item.ratingKey for item in desired_items}
+    current_keys = set()
+    items_to_remove = []
+
+    for item in current_items:
+        if item.ratingKey not in desired_keys or item.ratingKey in current_keys:
+            items_to_remove.append(item)
+        current_keys.add(item.ratingKey)
+
+    items_to_add = [item for item in desired_items if item.ratingKey not in current_keys]
+    return items_to_add, items_to_remove
+
+def server_call(pacer, func, *args, **kwargs):
+    return pacer.call(func, *args, **kwargs) if pacer else func(*args, **kwargs)
+
+def remove_playlist_items(playlist, items, pacer=None):
+    # Delete by playlistItemID directly; plexapi's removeItems rescans the playlist per item
+    # and can't target a specific duplicate entry
+    for item in items:
+        key = f"{playlist.key}/items/{item.playlistItemID}"
+        server_call(pacer, playlist._server.query, key, method=playlist._server._session.delete)
+
+def longest_increasing_subsequence(values):
+    # Indices of one longest strictly increasing subsequence, O(n log n)
+    tails, tail_indices, previous = [], [], [None] * len(values)
+    for i, value in enumerate(values):
+        position = bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[position] = value
+            tail_indices[position] = i
+        previous[i] = tail_indices[position - 1] if position else None
+
+    indices = []
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        indices.append(i)
+        i = previous[i]
+    return indices[::-1]
+
+def plan_moves(current_keys, desired_keys):
+    # Items on the longest run already in desired order stay put; every other item is moved
+    # directly after its desired predecessor (None = top), walking the desired order so each
+    # predecessor is already in place. Returns [(key, after_key)] with len = n - LIS.
+    position = {key: i for i, key in enumerate(desired_keys)}
+    present = [key for key in current_keys if key in position]
+    keep = {present[i] for i in longest_increasing_subsequence([position[key] for key in present])}
+    present = set(present)
+    ordered = [key for key in desired_keys if key in present]
+
+    moves = []
+    for i, key in enumerate(ordered):
+        if key not in keep:
+            moves.append((key, ordered[i - 1] if i else None))
+    return moves
+
+def reorder_playlist(playlist, desired_items, pacer=None):
+    # Fresh listing: playlistItemIDs of items added this run aren't in plexapi's cached items()
+    current = playlist.fetchItems(f"{playlist.key}/items")
+    by_key = {item.ratingKey: item for item in current}
+    moves = plan_moves([item.ratingKey for item in current], [item.ratingKey for item in desired_items])
+
+    for key, after_key in moves:
+        move_key = f"{playlist.key}/items/{by_key[key].playlistItemID}/move"
+        if after_key is not None:
+            move_key += f"?after={by_key[after_key].playlistItemID}"
+        server_call(pacer, playlist._server.query, move_key, method=playlist._server._session.put)
+    return len(moves)
+
+def sync_playlist(plex, playlist_name, items, pacer, playlist=None):
+    # Create, update, reorder or delete one playlist so it holds exactly `items` in sorted order
+    combined_items = sorted_playlist_items(items)
+    logging.info(f"Found {len(combined_items)} unwatched items for '{playlist_name}'")
+
+    if not combined_items:
+        if playlist is not None:
+            server_call(pacer, playlist.delete)
+            logging.info(f"Deleted empty playlist '{playlist_name}'")
+        else:
+            logging.info(f"No unwatched items for '{playlist_name}'. Playlist will not be created.")
+        return
+
+    if playlist is None:
+        # Create playlist in latency-paced batches
+        logging.info(f"Creating new playlist '{playlist_name}'")
+        for batch_number, batch in enumerate(pacer.batches(combined_items), 1):
+            if playlist is None:
+                playlist = pacer.call(plex.createPlaylist, title=playlist_name, items=batch)
+                logging.info(f"Created playlist '{playlist_name}' with initial {len(batch)} items")
+            else:
+                pacer.call(playlist.addItems, batch)
+                logging.info(f"Appended batch {batch_number} with {len(batch)} items to '{playlist_name}'")
+        return
+
+    logging.info(f"Updating existing playlist '{playlist_name}'")
+    items_to_add, items_to_remove = diff_playlist(playlist.items(), combined_items)
+
+    if items_to_remove:
+        remove_playlist_items(playlist, items_to_remove, pacer)
+        logging.info(f"Removed {len(items_to_remove)} items from '{playlist_name}'")
+
+    # Add items in latency-paced batches
+    for batch_number, batch in enumerate(pacer.batches(items_to_add), 1):
+        pacer.call(playlist.addItems, batch)
+        logging.info(f"Added batch {batch_number} with {len(batch)} items to '{playlist_name}'")
+
+    # Restore chronological order with the fewest possible move calls
+    moved = reorder_playlist(playlist, combined_items, pacer)
+    if moved:
+        logging.info(f"Moved {moved} items to restore order in '{playlist_name}'")
+
+def sync_playlists(plex, desired_playlists, pacer, max_workers=4, existing_playlists=None):
+    # desired_playlists: {playlist name: items}. Playlists are reconciled on a bounded worker
+    # pool sharing the server's pooled session; one failing playlist doesn't stop the others.
+    if existing_playlists is None:
+        existing_playlists = plex.playlists()
+    existing_by_title = {playlist.title: playlist for playlist in existing_playlists}
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(sync_playlist, plex, name, items, pacer, existing_by_title.get(name)): name
+            for name, items in desired_playlists.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Failed to process playlist '{name}': {e}")
+                failed.append(name)
+
+    return failed
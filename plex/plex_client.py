@@ -0,0 +1,179 @@
+import os
+import re
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Retries after the first attempt; delays grow as BACKOFF_SECONDS * 2^attempt (capped), with full jitter
+MAX_RETRIES = int(os.getenv("PLEX_MAX_RETRIES", "4"))
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+DEFAULT_POOL_SIZE = 10
+
+# Responses retried for idempotent methods. A 502/504 from a proxy doesn't mean Plex skipped the
+# request, so other methods are only retried on statuses that do (rate limited, unavailable).
+RETRY_STATUSES = {429, 502, 503, 504}
+REJECTED_STATUSES = {429, 503}
+# Methods also retried after a read timeout or dropped connection, when the server may have acted on them
+# (not PUT: Plex uses it to append playlist items)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "DELETE"})
+
+# Latency histogram bucket upper bounds, in milliseconds
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def endpoint_name(method, url):
+    # Group requests by endpoint: query dropped, ids and id lists collapsed ("/library/metadata/{id}")
+    path = urlsplit(url).path or "/"
+    path = re.sub(r"/\d+(,\d+)*(?=/|$)", "/{id}", path)
+    return f"{method.upper()} {path}"
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt))
+
+class RequestMetrics:
+    # Per-endpoint request counters and latency histograms, shared by every session in the process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, elapsed, ok, retried=False):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                "requests": 0, "errors": 0, "retries": 0, "seconds": 0.0,
+                "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            })
+            stats["requests"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["retries"] += 1 if retried else 0
+            stats["seconds"] += elapsed
+            stats["histogram"][bisect_left(LATENCY_BUCKETS_MS, elapsed * 1000)] += 1
+
+    def percentile(self, endpoint, fraction):
+        # Upper bound of the bucket holding this fraction of requests (None: slower than the last bucket)
+        stats = self.endpoints[endpoint]
+        threshold = stats["requests"] * fraction
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + (None,), stats["histogram"]):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return None
+
+    def summary(self):
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(), key=lambda entry: -entry[1]["seconds"])
+            for endpoint, stats in endpoints:
+                p50, p95 = (self.percentile(endpoint, fraction) for fraction in (0.5, 0.95))
+                lines.append(
+                    f"{endpoint}: {stats['requests']} requests, {stats['errors']} errors, "
+                    f"{stats['retries']} retries, {stats['seconds']:.1f}s total, "
+                    f"p50 <= {p50 or '>10000'}ms, p95 <= {p95 or '>10000'}ms"
+                )
+        return lines
+
+    def log_summary(self, log=logging.info):
+        if not self.endpoints:
+            return
+        log("Plex request metrics (slowest endpoints first):")
+        for line in self.summary():
+            log(f"  {line}")
+
+METRICS = RequestMetrics()
+
+class PlexSession(requests.Session):
+    # Keep-alive session with a connection pool sized for the caller's worker count, retries with
+    # exponential backoff and jitter, and per-endpoint metrics
+    def __init__(self, headers=None, pool_size=DEFAULT_POOL_SIZE, max_retries=MAX_RETRIES,
+                 retry_methods=IDEMPOTENT_METHODS, metrics=METRICS):
+        super().__init__()
+        self.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.max_retries = max_retries
+        self.retry_methods = retry_methods
+        self.metrics = metrics
+
+    def should_retry(self, method, response=None, error=None):
+        if response is not None:
+            statuses = RETRY_STATUSES if method.upper() in self.retry_methods else REJECTED_STATUSES
+            return response.status_code in statuses
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        return method.upper() in self.retry_methods and isinstance(
+            error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        )
+
+    def request(self, method, url, *args, **kwargs):
+        endpoint = endpoint_name(method, url)
+        for attempt in range(self.max_retries + 1):
+            response, error = None, None
+            started = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+            elapsed = time.monotonic() - started
+
+            retry = attempt < self.max_retries and self.should_retry(method, response, error)
+            ok = error is None and response.status_code < 400
+            self.metrics.record(endpoint, elapsed, ok, retried=retry)
+            if not retry:
+                if error is not None:
+                    raise error
+                return response
+
+            delay = backoff_delay(attempt)
+            logging.warning(
+                f"{endpoint} failed ({error or response.status_code}), "
+                f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+def make_session(headers=None, pool_size=DEFAULT_POOL_SIZE, **kwargs):
+    return PlexSession(headers, pool_size, **kwargs)
+
+_shared_sessions = {}
+_shared_lock = threading.Lock()
+
+def shared_session(headers, pool_size=DEFAULT_POOL_SIZE):
+    # One session per set of headers (i.e. per server token), so helpers reuse connections across calls
+    key = tuple(sorted(headers.items()))
+    with _shared_lock:
+        if key not in _shared_sessions:
+            _shared_sessions[key] = make_session(headers, pool_size)
+        return _shared_sessions[key]
+
+def get_available_servers():
+    # Servers set up by setup_plex_env.py: the <name> of each PLEX_TOKEN_<name> variable
+    return [var[len("PLEX_TOKEN_"):] for var in os.environ if var.startswith("PLEX_TOKEN_")]
+
+def get_server_config(server):
+    plex_token = os.getenv(f"PLEX_TOKEN_{server}")
+    plex_base_url = os.getenv(f"PLEX_BASE_URL_{server}")
+
+    if not plex_token or not plex_base_url:
+        raise EnvironmentError(f"Missing PLEX_TOKEN_{server} or PLEX_BASE_URL_{server}")
+    return plex_base_url, plex_token
+
+def connect(base_url, token, product, client_identifier, pool_size=DEFAULT_POOL_SIZE):
+    # plexapi server on a pooled, retrying session; connection failures are retried by the session
+    from plexapi import BASE_HEADERS
+    from plexapi.server import PlexServer
+
+    BASE_HEADERS['X-Plex-Client-Identifier'] = os.getenv("PLEX_CLIENT_IDENTIFIER", client_identifier)
+    BASE_HEADERS['X-Plex-Product'] = product
+    BASE_HEADERS['X-Plex-Version'] = "1.0"
+
+    try:
+        return PlexServer(base_url, token, session=make_session({}, pool_size))
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Could not connect to Plex server at {base_url}: {e}")
+        raise RuntimeError(f"Could not connect to Plex server at {base_url}") from e
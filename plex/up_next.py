@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# Watch history exported by export_plex_data.py (plex_export_<server>.db); unset uses only the library cache
+EXPORT_DB_PATH = os.getenv("PLEX_EXPORT_DB")
+
+# Shows watched within this many days count as in progress
+try:
+    ACTIVE_DAYS = int(os.getenv("UP_NEXT_ACTIVE_DAYS", "30"))
+except ValueError:
+    ACTIVE_DAYS = 30
+
+# Unwatched episodes queued per active show, after its most recently watched episode
+EPISODES_PER_SHOW = 2
+
+# Offsets below this are accidental starts, not partially watched items
+MIN_PROGRESS_MS = 60000
+
+HistoryEntry = namedtuple("HistoryEntry", "last_viewed_at view_offset view_count")
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def load_watch_history(db_path=EXPORT_DB_PATH):
+    # {guid or rating key: HistoryEntry} from the export's media table
+    if not db_path:
+        return {}
+    if not os.path.exists(db_path):
+        logging.warning(f"Watch history DB not found: {db_path}")
+        return {}
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT rating_key, guid, last_viewed_at, view_offset, view_count
+            FROM media
+            WHERE last_viewed_at IS NOT NULL OR view_offset IS NOT NULL
+        """).fetchall()
+    except sqlite3.Error as e:
+        logging.warning(f"Could not read watch history from {db_path}: {e}")
+        return {}
+    finally:
+        conn.close()
+
+    history = {}
+    for rating_key, guid, last_viewed_at, view_offset, view_count in rows:
+        history[guid or str(rating_key)] = HistoryEntry(to_int(last_viewed_at), to_int(view_offset), to_int(view_count))
+    logging.info(f"Loaded watch history for {len(history)} items from {db_path}")
+    return history
+
+def history_entry(item, history):
+    # Match on guid first, which survives a move to another server; rating keys only within one server
+    return history.get(item.guid) or history.get(str(item.ratingKey))
+
+def last_viewed(item, entry):
+    # Latest of the library's own lastViewedAt and the exported one, as a timestamp
+    viewed = int(item.lastViewedAt.timestamp()) if item.lastViewedAt else 0
+    return max(viewed, entry.last_viewed_at if entry else 0)
+
+def episode_order(item):
+    return (item.parentIndex or 0, item.index or 0)
+
+def rank_up_next(items, history, now=None, active_days=ACTIVE_DAYS, episodes_per_show=EPISODES_PER_SHOW):
+    # items: every movie/episode of the tracked sections (watched ones included, they locate each show's
+    # position). Returns unwatched items in predicted watch order: partially watched items, most recent
+    # first, then the next episodes of recently active shows, the most recently active show first.
+    now = now or datetime.now()
+    active_since = int((now - timedelta(days=active_days)).timestamp())
+
+    in_progress = []
+    shows = {}
+    for item in items:
+        entry = history_entry(item, history)
+        viewed = last_viewed(item, entry)
+        if not item.isWatched and entry and entry.view_offset >= MIN_PROGRESS_MS and viewed >= active_since:
+            in_progress.append((viewed, item))
+        if item.type == "episode" and item.grandparentRatingKey:
+            shows.setdefault(item.grandparentRatingKey, []).append((viewed, item))
+
+    up_next = []
+    for episodes in shows.values():
+        activity, latest = max(episodes, key=lambda pair: pair[0])
+        if activity < active_since:
+            continue
+        position = episode_order(latest)
+        following = sorted(
+            (item for _, item in episodes if not item.isWatched and episode_order(item) > position),
+            key=episode_order
+        )
+        for offset, item in enumerate(following[:episodes_per_show]):
+            up_next.append((offset, -activity, item))
+
+    ranked, seen = [], set()
+    for item in [item for _, item in sorted(in_progress, key=lambda pair: -pair[0])] + \
+            [item for _, _, item in sorted(up_next, key=lambda entry: entry[:2])]:
+        if item.ratingKey not in seen:
+            seen.add(item.ratingKey)
+            ranked.append(item)
+    return ranked
@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from plex_client import make_session
+
+LIBRARY_IDENTIFIER = "com.plexapp.plugins.library"
+
+# Resume points closer than this to the target's current offset are left alone
+PROGRESS_TOLERANCE_MS = 5000
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def plan_actions(rating_key, view_count=None, view_offset=None, user_rating=None):
+    # Order matters: scrobbling clears the resume point, so progress is sent after it
+    actions = []
+    if view_count and int(view_count) > 0:
+        actions.append(("scrobble", rating_key, None))
+    if view_offset and int(view_offset) > 0:
+        actions.append(("progress", rating_key, int(view_offset)))
+    if user_rating is not None and str(user_rating) != "":
+        actions.append(("rate", rating_key, float(user_rating)))
+    return actions
+
+def diff_actions(actions, current):
+    # Drop actions the target already reflects; current is the target item's attributes
+    # (viewCount/viewOffset/userRating as returned by the section listing)
+    current_view_count = int(current.get("viewCount") or 0)
+    current_offset = int(current.get("viewOffset") or 0)
+    current_rating = current.get("userRating")
+
+    changed = []
+    for action in actions:
+        kind, _, value = action
+        if kind == "scrobble" and current_view_count > 0:
+            continue
+        # A scrobble we are about to send clears the target's resume point, so keep progress then
+        scrobbling = any(a[0] == "scrobble" for a in changed)
+        if kind == "progress" and not scrobbling and abs(current_offset - value) <= PROGRESS_TOLERANCE_MS:
+            continue
+        if kind == "rate" and current_rating is not None and float(current_rating) == value:
+            continue
+        changed.append(action)
+    return changed
+
+def action_request(action):
+    kind, rating_key, value = action
+    params = {"key": rating_key, "identifier": LIBRARY_IDENTIFIER}
+    if kind == "scrobble":
+        return "GET", "/:/scrobble", params
+    if kind == "progress":
+        params.update({"time": value, "state": "stopped"})
+        return "GET", "/:/progress", params
+    if kind == "rate":
+        # Plex only accepts ratings as PUT (as plexapi sends them)
+        params["rating"] = f"{value:g}"
+        return "PUT", "/:/rate", params
+    raise ValueError(f"Unknown action: {kind}")
+
+def describe_action(action):
+    kind, _, value = action
+    if kind == "scrobble":
+        return "mark watched"
+    if kind == "progress":
+        return f"resume at {value // 60000}m{value // 1000 % 60:02d}s"
+    return f"rate {value:g}"
+
+def apply_item_actions(session, base_url, bucket, actions):
+    # Actions for one item run in order on the same worker; items run in parallel
+    results = []
+    for action in actions:
+        method, path, params = action_request(action)
+        bucket.acquire()
+        try:
+            res = session.request(method, f"{base_url}{path}", params=params)
+            results.append((action, res.status_code == 200, res.status_code))
+        except requests.exceptions.RequestException as e:
+            results.append((action, False, e))
+    return results
+
+def apply_actions(base_url, headers, planned, max_workers=8, rate_per_second=20, dry_run=False):
+    # planned: list of (label, actions) pairs; returns list of (label, action, ok, detail)
+    if dry_run:
+        return [(label, action, True, "dry run") for label, actions in planned for action in actions]
+
+    # Scrobbles count plays, so they are only retried when the server refused them (429/503) or never
+    # received them
+    session = make_session(headers, max_workers, retry_methods=frozenset())
+    bucket = TokenBucket(rate_per_second)
+    results = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(apply_item_actions, session, base_url, bucket, actions): label
+            for label, actions in planned if actions
+        }
+        for future in as_completed(futures):
+            label = futures[future]
+            for action, ok, detail in future.result():
+                results.append((label, action, ok, detail))
+
+    session.close()
+    return results
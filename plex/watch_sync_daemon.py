@@ -0,0 +1,281 @@
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+from xml.etree import ElementTree
+
+from media_index import LEAF_TYPES, build_server_index, fetch_section_items, get_sections
+from export_schema import to_int
+from media_map import MAP_DB_NAME, MediaMap
+from plex_client import METRICS, get_available_servers, get_server_config, make_session
+from watch_state import apply_actions, describe_action, diff_actions, plan_actions
+
+# Seconds between polls of each server's recently viewed items
+POLL_SECONDS = float(os.getenv("WATCH_SYNC_INTERVAL", "10"))
+
+# On first start, changes from this many hours back are synced
+LOOKBACK_HOURS = 24
+
+# A target index older than this is rebuilt when an item can't be mapped (e.g. newly added media)
+INDEX_REFRESH_SECONDS = 300
+
+SYNC_WORKERS = 4
+SYNC_RATE_PER_SECOND = 10
+
+# Polls a change that failed to reach a target is sent again before it is given up
+SYNC_RETRIES = 5
+
+# Rating keys per /library/metadata/a,b,c request when reading target state
+METADATA_BATCH_SIZE = 200
+
+def item_state(attrib):
+    return tuple(to_int(attrib.get(field)) or 0 for field in ("lastViewedAt", "viewCount", "viewOffset"))
+
+def first_file(element):
+    part = element.find("Media/Part")
+    return part.attrib.get("file") if part is not None else None
+
+class SyncServer:
+    # One Plex server taking part in the sync: its session, sections and a matching index
+    def __init__(self, name, base_url, token):
+        self.name = name
+        self.base_url = base_url
+        self.headers = {'X-Plex-Token': token}
+        self.session = make_session(self.headers, SYNC_WORKERS)
+        self.sections = []
+        self.index = None
+        self.index_built = 0.0
+
+    def load_sections(self):
+        self.sections = [section for section in get_sections(self.base_url, self.headers) if section[2] in LEAF_TYPES]
+
+    def refresh_index(self):
+        self.index = build_server_index(self.base_url, self.headers)
+        self.index_built = time.monotonic()
+        logging.info(f"[{self.name}] Indexed {len(self.index)} items")
+
+    def recently_viewed(self, since):
+        # Items played, finished or stopped part-way at or after the watermark (Plex's >>= is strictly
+        # after, hence since - 1): one filtered listing per section
+        elements = []
+        for section_key, _, section_type in self.sections:
+            elements += fetch_section_items(
+                self.base_url, self.headers, section_key, section_type, f"&lastViewedAt>>={since - 1}"
+            )
+        return elements
+
+    def current(self, rating_keys):
+        # Current attributes by rating key, one metadata request per batch; deleted items are left out
+        rating_keys = sorted(set(rating_keys))
+        current = {}
+        for i in range(0, len(rating_keys), METADATA_BATCH_SIZE):
+            batch = rating_keys[i:i + METADATA_BATCH_SIZE]
+            res = self.session.get(f"{self.base_url}/library/metadata/{','.join(batch)}")
+            if res.status_code == 404:
+                continue
+            res.raise_for_status()
+            for element in ElementTree.fromstring(res.content):
+                current[element.attrib.get("ratingKey")] = element.attrib
+        return current
+
+class WatchSync:
+    def __init__(self, servers, map_path=MAP_DB_NAME, lookback_hours=LOOKBACK_HOURS, dry_run=False):
+        self.servers = servers
+        self.dry_run = dry_run
+        self.conn = sqlite3.connect(map_path)
+        self.maps = {
+            (source.name, target.name): MediaMap(self.conn, source.name, target.name, map_path)
+            for source in servers for target in servers if source is not target
+        }
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS media_map.sync_watermarks (
+            server TEXT PRIMARY KEY,
+            last_viewed_at INTEGER
+        )
+        ''')
+        self.conn.commit()
+
+        start = int(time.time() - lookback_hours * 3600)
+        stored = dict(self.conn.execute("SELECT server, last_viewed_at FROM media_map.sync_watermarks"))
+        self.watermarks = {server.name: stored.get(server.name, start) for server in servers}
+        # Last propagated state per (server, rating key): polls include the watermark's own second,
+        # and items we just updated come back on the next poll
+        self.seen = {}
+        # Failed polls per (server, rating key), so a change a target keeps rejecting can't hold the watermark forever
+        self.failures = {}
+
+    def close(self):
+        self.conn.close()
+
+    def save_watermark(self, server):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO media_map.sync_watermarks (server, last_viewed_at) VALUES (?, ?)",
+            (server.name, self.watermarks[server.name])
+        )
+        self.conn.commit()
+
+    def resolve(self, source, target, element):
+        media_map = self.maps[(source.name, target.name)]
+        attrib = element.attrib
+        args = (attrib["ratingKey"], media_map.lookup(attrib["ratingKey"]))
+        kwargs = {
+            "guid": attrib.get("guid"), "file_path": first_file(element), "title": attrib.get("title"),
+            "year": attrib.get("year") or attrib.get("originallyAvailableAt"),
+        }
+
+        target_key, _ = media_map.resolve(target.index, *args, **kwargs)
+        if target_key is None and time.monotonic() - target.index_built > INDEX_REFRESH_SECONDS:
+            target.refresh_index()
+            target_key, _ = media_map.resolve(target.index, *args, **kwargs)
+        return target_key
+
+    def plan(self, element, target_key, current):
+        # Newest lastViewedAt wins: the source state is pushed only if the target saw the item earlier
+        if item_state(current)[0] >= item_state(element.attrib)[0]:
+            return []
+        actions = plan_actions(target_key, element.attrib.get("viewCount"), element.attrib.get("viewOffset"))
+        return diff_actions(actions, current)
+
+    def poll(self, source):
+        since = self.watermarks[source.name]
+        changed = {}
+        for element in source.recently_viewed(since):
+            key = (source.name, element.attrib["ratingKey"])
+            if self.seen.get(key) != item_state(element.attrib):
+                changed[element.attrib["ratingKey"]] = element
+        if not changed:
+            return 0
+
+        # Source rating keys that didn't reach every target; they stay unseen and hold the watermark
+        failed = set()
+        applied = 0
+        for target in self.servers:
+            if target is not source:
+                applied += self.push(source, target, changed, failed)
+
+        for rating_key in list(failed):
+            key = (source.name, rating_key)
+            self.failures[key] = self.failures.get(key, 0) + 1
+            if self.failures[key] > SYNC_RETRIES:
+                logging.error(f"[{source.name}] Giving up on '{changed[rating_key].attrib.get('title')}' "
+                              f"after {SYNC_RETRIES} retries")
+                failed.discard(rating_key)
+
+        done = [element for rating_key, element in changed.items() if rating_key not in failed]
+        for element in done:
+            key = (source.name, element.attrib["ratingKey"])
+            self.seen[key] = item_state(element.attrib)
+            self.failures.pop(key, None)
+
+        # The next poll starts at the oldest failed change, so it is sent again (also after a restart)
+        watermark = max([since] + [item_state(element.attrib)[0] for element in done])
+        if failed:
+            watermark = min([watermark] + [item_state(changed[rating_key].attrib)[0] for rating_key in failed])
+        self.watermarks[source.name] = max(since, watermark)
+        self.save_watermark(source)
+        return applied
+
+    def push(self, source, target, changed, failed):
+        # Sends the changed source items' state to one target; adds the ones that failed to `failed`
+        prefix = f"[{source.name} -> {target.name}]"
+        resolved = []
+        for rating_key, element in changed.items():
+            try:
+                target_key = self.resolve(source, target, element)
+            except Exception as e:
+                logging.warning(f"{prefix} Could not map '{element.attrib.get('title')}': {e}")
+                failed.add(rating_key)
+                continue
+            if target_key is not None:
+                resolved.append((rating_key, target_key))
+        self.maps[(source.name, target.name)].save()
+
+        # Target state of every resolved item in a few batched requests, not one per item
+        try:
+            current = target.current(target_key for _, target_key in resolved)
+        except Exception as e:
+            logging.warning(f"{prefix} Could not read current state: {e}")
+            failed.update(rating_key for rating_key, _ in resolved)
+            return 0
+
+        planned = []
+        for rating_key, target_key in resolved:
+            title = changed[rating_key].attrib.get("title")
+            if target_key not in current:
+                logging.warning(f"{prefix} Skipping '{title}': item {target_key} no longer exists")
+                continue
+            actions = self.plan(changed[rating_key], target_key, current[target_key])
+            if actions:
+                planned.append((rating_key, actions))
+
+        applied = 0
+        for rating_key, action, ok, detail in apply_actions(
+            target.base_url, target.headers, planned,
+            max_workers=SYNC_WORKERS, rate_per_second=SYNC_RATE_PER_SECOND, dry_run=self.dry_run
+        ):
+            title = changed[rating_key].attrib.get("title")
+            if ok:
+                applied += 1
+                logging.info(f"{prefix} {describe_action(action)}: {title}")
+            else:
+                logging.error(f"{prefix} Failed to {describe_action(action)}: {title} ({detail})")
+                failed.add(rating_key)
+        return applied
+
+    def sync_once(self):
+        applied = 0
+        for source in self.servers:
+            try:
+                applied += self.poll(source)
+            except Exception as e:
+                logging.error(f"[{source.name}] Poll failed: {e}")
+        return applied
+
+    def run(self, interval=POLL_SECONDS):
+        logging.info(f"Syncing watch state between {', '.join(server.name for server in self.servers)}")
+        try:
+            while True:
+                started = time.monotonic()
+                self.sync_once()
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            logging.info("Stopping watch sync")
+
+def configured_servers(names=None):
+    return [SyncServer(name, *get_server_config(name)) for name in names or get_available_servers()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep watch state in sync between Plex servers.")
+    parser.add_argument("--servers", help="Comma-separated PLEX_TOKEN_<name> names (default: all configured)")
+    parser.add_argument("--interval", type=float, default=POLL_SECONDS, help="Seconds between polls")
+    parser.add_argument("--map-db", default=MAP_DB_NAME, help="Media mapping DB shared with the import")
+    parser.add_argument("--lookback-hours", type=float, default=LOOKBACK_HOURS,
+                        help="On first start, sync changes from this many hours back")
+    parser.add_argument("--once", action="store_true", help="Poll every server once and exit")
+    parser.add_argument("--dry-run", action="store_true", help="Log changes without sending them")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    servers = configured_servers(args.servers.split(",") if args.servers else None)
+    if len(servers) < 2:
+        raise EnvironmentError("Watch sync needs at least two configured Plex servers")
+    for server in servers:
+        server.load_sections()
+        server.refresh_index()
+
+    sync = WatchSync(servers, args.map_db, args.lookback_hours, dry_run=args.dry_run)
+    try:
+        if args.once:
+            sync.sync_once()
+        else:
+            sync.run(args.interval)
+    finally:
+        sync.close()
+        METRICS.log_summary()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())